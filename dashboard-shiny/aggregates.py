@@ -0,0 +1,60 @@
+"""
+Aggregate cube of the dataset, answering the plots without scanning all rows.
+
+The cube holds one row per observed (year, category, language, sentiment)
+combination with the number of talks and the views statistics. It is built
+once and persisted next to the dataset. The parent categories are not a key,
+a category can have several of them, they are looked up from the category
+with category_hierarchy.
+"""
+
+import pandas as pd
+
+from datastore import app_dir, replace_file, source_path
+
+cube_path = app_dir / "FINAL_TEDX_DATASET_2024_cube.feather"
+cube_keys = ["year", "category", "language", "sentiment"]
+
+
+def build_cube(df):
+    cube = (
+        df.groupby(cube_keys, observed=True, dropna=False)
+        .agg(
+            count=("views", "size"),
+            views_sum=("views", "sum"),
+            views_count=("views", "count"),
+        )
+        .reset_index()
+    )
+    cube = cube.astype({"count": "int64", "views_sum": "int64", "views_count": "int64"})
+    cube["views_mean"] = cube["views_sum"] / cube["views_count"]
+    return cube
+
+
+def save_cube(cube, path=cube_path):
+    # Written aside and renamed, other workers never read a partial file
+    replace_file(path, cube.to_feather)
+
+
+def load_cube(df):
+    """
+    Reads the persisted cube, rebuilding it from df when it is missing
+    or older than the dataset file.
+    """
+    if (
+        cube_path.exists()
+        and cube_path.stat().st_mtime >= source_path().stat().st_mtime
+    ):
+        try:
+            return pd.read_feather(cube_path)
+        except ImportError:
+            # pyarrow is not installed
+            pass
+
+    cube = build_cube(df)
+    try:
+        save_cube(cube)
+    except (ImportError, OSError):
+        # The cube is cheap to rebuild, keep it in memory only
+        pass
+    return cube
@@ -2,7 +2,15 @@
 from shared import (
     app_dir,
     df,
-    geojson_data,
+    cube,
+    views_frame,
+    figure_cache,
+    get_wordcloud,
+    marker_index,
+    search_talks,
+    search_columns,
+    data_browser,
+    take_rows,
     show_category_notification,
     show_map_notification,
     show_map_description,
@@ -13,6 +21,7 @@ from shiny.express import input, render, ui
 from shinywidgets import render_widget, render_plotly
 import ipyleaflet as L
 import ipywidgets as widgets
+from functools import partial
 
 from plots import (
     line_plot_videos_views,
@@ -24,13 +33,19 @@ from plots import (
     log_scale_boxplot_by_categories,
     views_vs_title_length_plot,
 )
-from plots import get_parent_categories
+from plots import get_parent_categories, WordCloud
+from filters import filter_views
+from data_browser import page_count
+from reactive_utils import debounce
 
 ui.page_opts(title="TEDx Video Titles Analysis")
 
 sort_status = reactive.Value(False)
 current_tab = reactive.Value("")
 progress = reactive.Value(0)
+search_page = reactive.Value(0)
+browser_page = reactive.Value(0)
+browser_page_size = 25
 
 ui.nav_spacer()  # Push the navbar items to the right
 
@@ -117,14 +132,182 @@ with ui.nav_panel("Description"):
                                         </ol>"""
                     )
 
-        with ui.nav_panel("Data preview"):
+        with ui.nav_panel("Data browser"):
             with ui.card():
-                ui.input_action_button("row_button", "Show first 5 rows")
+                with ui.layout_columns():
+                    ui.input_select(
+                        "browser_sort", "Sort by", ["views", "year", "title length"]
+                    )
+                    ui.input_select(
+                        "browser_order", "Order", ["Descending", "Ascending"]
+                    )
+                    ui.input_select(
+                        "browser_language",
+                        "Language",
+                        ["All Languages"]
+                        + [
+                            lang
+                            for lang in df["language"].unique()
+                            if lang != "unknown"
+                        ],
+                    )
+                    ui.input_select(
+                        "browser_category",
+                        "Category",
+                        ["All categories"] + list(df["category"].dropna().unique()),
+                    )
+                    ui.input_select(
+                        "browser_sentiment",
+                        "Sentiment",
+                        ["All sentiments", "Positive", "Neutral", "Negative"],
+                    )
+                    ui.input_slider(
+                        "browser_years",
+                        "Select a date range",
+                        min=2009,
+                        max=2024,
+                        value=[2009, 2024],
+                        step=1,
+                        sep="",
+                    )
+
+                @reactive.calc
+                def browser_mask():
+                    language = input.browser_language()
+                    category = input.browser_category()
+                    sentiment = input.browser_sentiment()
+                    years = input.browser_years()
+                    return data_browser.mask(
+                        start_year=years[0] if years[0] > 2009 else None,
+                        end_year=years[1] if years[1] < 2024 else None,
+                        language=None if language == "All Languages" else language,
+                        category=None if category == "All categories" else category,
+                        sentiment=None if sentiment == "All sentiments" else sentiment,
+                    )
+
+                @reactive.calc
+                def browser_page_frame():
+                    # Only the visible page is taken from the dataset and sent
+                    return data_browser.page_frame(
+                        input.browser_sort(),
+                        input.browser_order() == "Descending",
+                        browser_mask(),
+                        browser_page.get(),
+                        browser_page_size,
+                    )
+
+                @reactive.effect
+                @reactive.event(
+                    input.browser_sort,
+                    input.browser_order,
+                    input.browser_language,
+                    input.browser_category,
+                    input.browser_sentiment,
+                    input.browser_years,
+                )
+                def reset_browser_page():
+                    browser_page.set(0)
+
+                @reactive.effect
+                @reactive.event(input.browser_previous)
+                def previous_browser_page():
+                    browser_page.set(max(0, browser_page.get() - 1))
+
+                @reactive.effect
+                @reactive.event(input.browser_next)
+                def next_browser_page():
+                    _, total = browser_page_frame()
+                    last_page = page_count(total, browser_page_size) - 1
+                    browser_page.set(min(last_page, browser_page.get() + 1))
+
+                with ui.layout_columns(col_widths=[2, 8, 2]):
+                    ui.input_action_button("browser_previous", "Previous page")
+
+                    @render.text
+                    def browser_summary():
+                        _, total = browser_page_frame()
+                        return (
+                            f"{total} talks, page {browser_page.get() + 1} "
+                            f"of {page_count(total, browser_page_size)}"
+                        )
+
+                    ui.input_action_button("browser_next", "Next page")
 
                 @render.data_frame
-                @reactive.event(input.row_button)
-                def show_first_rows():
-                    return df.head()
+                def browser_table():
+                    page, _ = browser_page_frame()
+                    return page
+
+
+with ui.nav_panel("Search"):
+    with ui.card():
+        with ui.layout_columns(col_widths=[7, 3, 2]):
+            ui.input_text(
+                "search_query",
+                "Search titles, speakers and events:",
+                placeholder="e.g. climate change, TEDxWarsaw",
+                width="100%",
+            )
+            ui.input_checkbox("search_fuzzy", "Match misspelled words", True)
+            ui.input_select(
+                "search_page_size",
+                "Rows per page",
+                ["10", "25", "50", "100"],
+                selected="25",
+            )
+
+        @reactive.calc
+        def search_results():
+            query = input.search_query().strip()
+            if not query:
+                return None
+            return search_talks(query, input.search_fuzzy())
+
+        @reactive.effect
+        @reactive.event(input.search_query, input.search_fuzzy, input.search_page_size)
+        def reset_search_page():
+            search_page.set(0)
+
+        def search_page_count():
+            rows = search_results()
+            if rows is None:
+                return 1
+            return page_count(len(rows), int(input.search_page_size()))
+
+        @reactive.effect
+        @reactive.event(input.search_previous)
+        def previous_search_page():
+            search_page.set(max(0, search_page.get() - 1))
+
+        @reactive.effect
+        @reactive.event(input.search_next)
+        def next_search_page():
+            search_page.set(min(search_page_count() - 1, search_page.get() + 1))
+
+        with ui.layout_columns(col_widths=[2, 8, 2]):
+            ui.input_action_button("search_previous", "Previous page")
+
+            @render.text
+            def search_summary():
+                rows = search_results()
+                if rows is None:
+                    return "Type a word, a speaker or an event to search the talks"
+                return (
+                    f"{len(rows)} talks found, page {search_page.get() + 1} "
+                    f"of {search_page_count()}"
+                )
+
+            ui.input_action_button("search_next", "Next page")
+
+        @render.data_frame
+        def search_table():
+            rows = search_results()
+            if rows is None:
+                return None
+            page_size = int(input.search_page_size())
+            start = search_page.get() * page_size
+            # Only the rows of the current page are sent to the browser
+            return take_rows(rows[start : start + page_size], search_columns)
 
 
 with ui.nav_panel("Basic plots"):
@@ -142,14 +325,14 @@ with ui.nav_panel("Basic plots"):
             def line_plot_widget():
                 selected_var = input.category()
                 current_tab.set("category")
-                return line_plot_videos_views(df, selected_var)
+                return figure_cache.get(line_plot_videos_views, cube, selected_var)
 
         with ui.nav_panel("Languages overview"):
 
             @render_plotly
             def treemap_widget():
                 selected_var = input.category()
-                return treemap_languages_plot(df, selected_var)
+                return figure_cache.get(treemap_languages_plot, cube, selected_var)
 
             url = "https://en.wikipedia.org/wiki/List_of_ISO_639_language_codes"
             ui.HTML(f' <a href="{url}" target="_blank">Check language codes here</a>')
@@ -163,7 +346,7 @@ with ui.nav_panel("Categories"):
 
                     @render_plotly
                     def sunburst_widget():
-                        return sunburst(df)
+                        return figure_cache.get(sunburst, cube)
 
                 with ui.card():
 
@@ -187,7 +370,7 @@ with ui.nav_panel("Categories"):
 
                     @render.data_frame
                     def data():
-                        table_df = sunburst_df(df)
+                        table_df = sunburst_df(cube)
                         table_df.columns = [
                             "Category I",
                             "Category II",
@@ -211,7 +394,9 @@ with ui.nav_panel("Categories"):
             @render_plotly
             def category_popularity_widget():
                 selected_category = input.category_inside()
-                return category_popularity_over_time(df, selected_category)
+                return figure_cache.get(
+                    category_popularity_over_time, cube, selected_category
+                )
 
 
 with ui.nav_panel("Wordcloud"):
@@ -220,6 +405,30 @@ with ui.nav_panel("Wordcloud"):
     ):
         with ui.nav_panel("Plot"):
 
+            if WordCloud is not None:
+                # Word clouds are rendered on demand for any combination of filters
+                with ui.layout_columns():
+                    ui.input_slider(
+                        "wordcloud_years",
+                        "Select a date range",
+                        min=2009,
+                        max=2024,
+                        value=[2009, 2024],
+                        step=1,
+                        sep="",
+                    )
+                    ui.input_select(
+                        "wordcloud_lang",
+                        "Select a language:",
+                        ["All Languages"]
+                        + [lang for lang in df["language"].unique() if lang != "unknown"],
+                    )
+                    ui.input_select(
+                        "wordcloud_sentiment",
+                        "Select a sentiment:",
+                        ["All sentiments", "Positive", "Neutral", "Negative"],
+                    )
+
             @render.ui
             def wordcloud_title():
                 selected_var = input.category2()
@@ -234,7 +443,24 @@ with ui.nav_panel("Wordcloud"):
             @render.image
             def wordcloud():
                 selected_var = input.category2()
-                img_src = str(app_dir / f"wordclouds/{selected_var}_wordcloud.png")
+                if WordCloud is None:
+                    img_src = str(app_dir / f"wordclouds/{selected_var}_wordcloud.png")
+                else:
+                    category = selected_var
+                    if selected_var == "All categories":
+                        category = None
+                    language = input.wordcloud_lang()
+                    if language == "All Languages":
+                        language = None
+                    sentiment = input.wordcloud_sentiment()
+                    if sentiment == "All sentiments":
+                        sentiment = None
+                    years = input.wordcloud_years()
+                    img_src = get_wordcloud(
+                        category, years[0], years[1], language, sentiment
+                    )
+                    if img_src is None:
+                        return None
                 return {
                     "src": img_src,
                     "alt": "Wordcloud",
@@ -271,20 +497,77 @@ with ui.nav_panel("Map of events"):
                     center=(0, 0), zoom=4, scroll_wheel_zoom=True, prefer_canvas=True
                 )
 
-                markers = [
-                    L.Marker(
-                        location=(
-                            feature["geometry"]["coordinates"][1],
-                            feature["geometry"]["coordinates"][0],
-                        ),
-                        draggable=False,
-                        popup=L.Popup(child=widgets.Output(value=feature['properties']['popup'])),
-                    )
-                    for feature in geojson_data["features"]
-                ]
+                # Only the clusters inside the viewport are sent to the browser
+                visible_clusters = L.LayerGroup()
+                m.add_layer(visible_clusters)
+
+                def show_popup(location, points):
+                    # Popups are created on demand, one at a time
+                    for layer in m.layers:
+                        if isinstance(layer, L.Popup):
+                            m.remove_layer(layer)
+                    labels = "<br>".join(marker_index.label(point) for point in points)
+                    popup = L.Popup(location=location, child=widgets.HTML(labels))
+                    m.add_layer(popup)
+
+                def on_click(location, cluster, point, count, **kwargs):
+                    if count == 1:
+                        show_popup(location, [point])
+                    elif marker_index.is_deepest(m.zoom):
+                        # Events geocoded to the very same place
+                        show_popup(location, marker_index.members(m.zoom, cluster))
+                    else:
+                        m.center = location
+                        m.zoom = m.zoom + 2
+
+                def show_clusters(change=None):
+                    if m.bounds:
+                        (south, west), (north, east) = m.bounds
+                    else:
+                        # Bounds are only known once the map is displayed
+                        south, west, north, east = -90, -180, 90, 180
+
+                    clusters = marker_index.query(south, west, north, east, m.zoom)
+                    layers = []
+                    for cluster, lat, lon, count, point in zip(
+                        clusters["cluster"],
+                        clusters["lat"],
+                        clusters["lon"],
+                        clusters["count"],
+                        clusters["point"],
+                    ):
+                        if count == 1:
+                            marker = L.Marker(location=(lat, lon), draggable=False)
+                        else:
+                            if count < 10:
+                                size = "small"
+                            elif count < 100:
+                                size = "medium"
+                            else:
+                                size = "large"
+                            marker = L.Marker(
+                                location=(lat, lon),
+                                draggable=False,
+                                icon=L.DivIcon(
+                                    html=f"<div><span>{count}</span></div>",
+                                    class_name=f"marker-cluster marker-cluster-{size}",
+                                    icon_size=[40, 40],
+                                ),
+                            )
+                        marker.on_click(
+                            partial(
+                                on_click,
+                                (lat, lon),
+                                int(cluster),
+                                int(point),
+                                int(count),
+                            )
+                        )
+                        layers.append(marker)
+                    visible_clusters.layers = layers
 
-                marker_cluster = L.MarkerCluster(markers=markers)
-                m.add_layer(marker_cluster)
+                m.observe(show_clusters, names="bounds")
+                show_clusters()
 
                 return m
 
@@ -306,7 +589,7 @@ with ui.nav_panel("Sentiment analysis"):
             def sentiment_analysis_widget():
                 current_tab.set("sentiment")
                 selected_var = input.category3()
-                return sentiment_analysis_plot(df, selected_var)
+                return figure_cache.get(sentiment_analysis_plot, cube, selected_var)
 
 
 with ui.nav_panel("Views correlation"):
@@ -347,31 +630,36 @@ with ui.nav_panel("Views correlation"):
                             sep="",
                         )
 
+            # Slider ticks and keystrokes settle before anything is recomputed,
+            # intermediate positions are never filtered nor rendered
+            @debounce(0.3)
+            def views_filters():
+                if input.select_all_checkbox():
+                    selected_categories = None
+                else:
+                    selected_categories = tuple(input.selectize_categories())
+                years = input.slider()
+                return years[0], years[1], selected_categories, input.selectize_lang()
+
+            # Shared by both plots, so the filters are evaluated once per change
+            @reactive.calc
+            def views_selection():
+                return filter_views(views_frame, *views_filters())
+
             with ui.layout_column_wrap(width=1 / 2):
                 with ui.card():
 
                     @render_plotly
                     def boxplot_by_grandparent_widget():
-                        if input.select_all_checkbox():
-                            selected_categories = None
-                        else:
-                            selected_categories = input.selectize_categories()
-                        selected_lang = input.selectize_lang()
-                        years = input.slider()
                         return log_scale_boxplot_by_categories(
-                            df, years[0], years[1], selected_categories, selected_lang
+                            views_selection(), views_filters()[2]
                         )
 
                 with ui.card():
 
                     @render_plotly
                     def views_vs_title_length_widget():
-                        if input.select_all_checkbox():
-                            selected_categories = None
-                        else:
-                            selected_categories = input.selectize_categories()
-                        selected_lang = input.selectize_lang()
-                        years = input.slider()
+                        selected_lang = views_filters()[3]
                         return views_vs_title_length_plot(
-                            df, years[0], years[1], selected_categories, selected_lang
+                            views_selection(), selected_lang
                         )
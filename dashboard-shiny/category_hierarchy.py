@@ -0,0 +1,181 @@
+"""
+Hierarchy of the talk categories, for the category plots and the Views
+correlation filters.
+
+Every category belongs to one or more parent categories ("storytelling" is both
+about culture and about literature), and every parent to a top-level group.
+The hierarchy gives every name an integer code once, and keeps the
+category-parent memberships as arrays sorted by category. Mapping the category
+column of the dataset to parents is then a lookup in those arrays, and a
+category with several parents is counted under each of them for an equal
+share, instead of under the last parent it was listed under.
+"""
+
+import numpy as np
+import pandas as pd
+
+hierarchy_mapping = {
+    "Human Experience": {
+        "Personal Growth": ["personal growth", "mental health", "psychology"],
+        "Health & Well-being": ["health", "nature"],
+        "Creativity & Arts": [
+            "creativity",
+            "art",
+            "music",
+            "design",
+            "entertainment",
+        ],
+        "Culture & Society": [
+            "culture",
+            "gender",
+            "social change",
+            "history",
+            "storytelling",
+        ],
+    },
+    "Knowledge & Education": {
+        "Literature & Communication": [
+            "literature",
+            "storytelling",
+            "communication",
+        ],
+        "Education & Learning": ["education", "innovation", "technology"],
+    },
+    "Global Issues": {
+        "Environment & Sustainability": [
+            "environment",
+            "climate change",
+            "sustainability",
+        ],
+        "Politics & Society": [
+            "politics",
+            "social change",
+            "global issues",
+            "humanity",
+        ],
+        "Economics & Work": ["economics", "business", "work"],
+    },
+    "Science & Technology": {
+        "Science & Exploration": ["science", "technology", "AI", "innovation"],
+        "Global Challenges": ["climate change", "sustainability", "global issues"],
+    },
+    "Lifestyle & Leisure": {
+        "Food & Entertainment": ["food", "entertainment", "design"],
+        "Leisure & Creativity": ["music"],  # Focused on music as part of leisure
+    },
+}
+
+
+class CategoryHierarchy:
+    def __init__(self, mapping):
+        self.mapping = mapping
+        grandparents, parents, categories = [], [], {}
+        parent_grandparent, member_categories, member_parents = [], [], []
+        for grandparent, subcategories in mapping.items():
+            grandparents.append(grandparent)
+            for parent, children in subcategories.items():
+                if parent in parents:
+                    raise ValueError(f"{parent} is listed under several groups")
+                parents.append(parent)
+                parent_grandparent.append(len(grandparents) - 1)
+                for child in children:
+                    code = categories.setdefault(child, len(categories))
+                    member_categories.append(code)
+                    member_parents.append(len(parents) - 1)
+
+        self.grandparents = pd.Index(grandparents)
+        self.parents = pd.Index(parents)
+        self.categories = pd.Index(list(categories))
+        self.parent_grandparent = np.array(parent_grandparent, dtype="int16")
+
+        # Memberships in the order of the mapping, for the tables
+        self.member_categories = np.array(member_categories, dtype="int16")
+        self.member_parents = np.array(member_parents, dtype="int16")
+        n_categories = len(self.categories)
+        self.parent_counts = np.bincount(
+            self.member_categories, minlength=n_categories
+        )
+        self.member_weights = 1 / self.parent_counts[self.member_categories]
+
+        # The same sorted by category, the parents of category c being at
+        # self.offsets[c]:self.offsets[c + 1]
+        order = np.argsort(self.member_categories, kind="stable")
+        self.sorted_parents = self.member_parents[order]
+        self.offsets = np.zeros(n_categories + 1, dtype="int64")
+        np.cumsum(self.parent_counts, out=self.offsets[1:])
+
+        self.membership = np.zeros((n_categories, len(self.parents)), dtype=bool)
+        self.membership[self.member_categories, self.member_parents] = True
+
+    def codes(self, values):
+        """
+        Returns the codes of a column of category names, -1 for the values
+        outside the hierarchy.
+        """
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # One lookup per distinct category, then an array take
+            lookup = self.categories.get_indexer(values.cat.categories)
+            lookup = np.append(lookup, -1)
+            return lookup[values.cat.codes.to_numpy()].astype("int16")
+        return self.categories.get_indexer(values.astype(object)).astype("int16")
+
+    def in_parents(self, codes, parents):
+        """
+        Returns the mask of the category codes belonging to any of the parents.
+        """
+        selected = self.membership[:, self.parents.get_indexer(parents)].any(axis=1)
+        # Code -1 reads the trailing False
+        return np.append(selected, False)[codes]
+
+    def memberships(self, codes, parents=None):
+        """
+        Returns the position in codes, the parent code and the weight of every
+        membership of the category codes, restricted to the given parents.
+        """
+        codes = np.asarray(codes)
+        inside = np.flatnonzero(codes >= 0)
+        counts = self.parent_counts[codes[inside]]
+        rows = np.repeat(inside, counts)
+        # Index of each membership within the memberships of its category
+        ends = np.cumsum(counts)
+        within = np.arange(len(rows)) - np.repeat(ends - counts, counts)
+        member_parents = self.sorted_parents[self.offsets[codes[rows]] + within]
+        weights = 1 / np.repeat(counts, counts)
+
+        if parents is not None:
+            keep = np.isin(member_parents, self.parents.get_indexer(parents))
+            rows, member_parents, weights = (
+                rows[keep],
+                member_parents[keep],
+                weights[keep],
+            )
+        return rows, member_parents, weights
+
+    def members(self):
+        """
+        Returns a DataFrame with the group, parent, category and weight of
+        every membership, in the order of the mapping.
+        """
+        return pd.DataFrame(
+            {
+                "grandparent": self.grandparents[
+                    self.parent_grandparent[self.member_parents]
+                ],
+                "parent": self.parents[self.member_parents],
+                "category": self.categories[self.member_categories],
+                "weight": self.member_weights,
+            }
+        )
+
+    def split(self, values):
+        """
+        Returns the members with their share of values, a Series indexed by
+        category name. The categories missing from values count for 0.
+        """
+        members = self.members()
+        values = values.set_axis(values.index.astype(object))
+        totals = values.reindex(members["category"]).fillna(0).to_numpy()
+        return members.assign(value=totals * members["weight"].to_numpy())
+
+
+hierarchy = CategoryHierarchy(hierarchy_mapping)
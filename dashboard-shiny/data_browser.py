@@ -0,0 +1,120 @@
+"""
+Sorted and filtered pages of the dataset for the "Data browser" table.
+
+The orders of the rows by views, year and title length are computed once. A
+page is read by walking the chosen order and keeping the rows matching the
+filters until the page is full, so only the rows of the page are ever taken
+from the dataset and sent to the browser, whatever the number of matches.
+"""
+
+import numpy as np
+
+from datastore import title_lengths
+
+browser_columns = [
+    "title",
+    "speaker",
+    "event",
+    "year",
+    "views",
+    "language",
+    "category",
+    "sentiment",
+]
+filter_columns = ["language", "category", "sentiment"]
+# Rows of the order checked against the filters at a time
+block_size = 65536
+
+
+def sort_keys(df):
+    return {
+        "views": df["views"],
+        "year": df["year"],
+        "title length": title_lengths(df),
+    }
+
+
+class DataBrowser:
+    def __init__(self, df, take=None):
+        self.df = df
+        self.n_rows = len(df)
+        # Reads the rows of a page, from the shared dataset in worker processes
+        self.take = take or (lambda rows, columns: df.iloc[rows][columns])
+
+        # Ascending and descending orders, the talks without a value last
+        self.orders = {}
+        for name, key in sort_keys(df).items():
+            values = key.to_numpy(dtype="float64", na_value=np.nan)
+            ascending = np.argsort(values, kind="stable").astype("int32")
+            n_valid = int(np.count_nonzero(~np.isnan(values)))
+            descending = np.concatenate(
+                [
+                    np.argsort(-values, kind="stable")[:n_valid],
+                    ascending[n_valid:],
+                ]
+            ).astype("int32")
+            self.orders[name, False] = ascending
+            self.orders[name, True] = descending
+
+        # Integer codes of the categorical filters, compared without strings
+        self.codes = {}
+        self.categories = {}
+        for column in filter_columns:
+            values = df[column].astype("category")
+            self.codes[column] = values.cat.codes.to_numpy()
+            self.categories[column] = values.cat.categories
+        self.year = df["year"].fillna(0).to_numpy(dtype="int16")
+
+    def mask(self, start_year=None, end_year=None, **values):
+        """
+        Returns the boolean mask of the rows matching the filters, None when
+        every row matches. values maps the filter columns to a selected value,
+        None selects all of them.
+        """
+        mask = None
+
+        def combine(condition):
+            return condition if mask is None else mask & condition
+
+        for column, value in values.items():
+            if value is None:
+                continue
+            categories = self.categories[column]
+            code = categories.get_loc(value) if value in categories else -2
+            mask = combine(self.codes[column] == code)
+        if start_year is not None:
+            mask = combine(self.year >= start_year)
+        if end_year is not None:
+            mask = combine(self.year <= end_year)
+        return mask
+
+    def page(self, sort_by="views", descending=True, mask=None, page=0, page_size=25):
+        """
+        Returns the rows of the page and the number of rows matching mask.
+        """
+        order = self.orders[sort_by, descending]
+        start = page * page_size
+        if mask is None:
+            return order[start : start + page_size], self.n_rows
+
+        total = int(np.count_nonzero(mask))
+        rows, seen = [], 0
+        for block_start in range(0, self.n_rows, block_size):
+            block = order[block_start : block_start + block_size]
+            matching = block[mask[block]]
+            if seen + len(matching) > start:
+                rows.append(matching[max(0, start - seen) :])
+                if sum(len(part) for part in rows) >= page_size:
+                    break
+            seen += len(matching)
+        if not rows:
+            return np.empty(0, dtype="int32"), total
+        return np.concatenate(rows)[:page_size], total
+
+    def page_frame(self, *args, columns=browser_columns, **kwargs):
+        rows, total = self.page(*args, **kwargs)
+        return self.take(rows, columns), total
+
+
+def page_count(total, page_size):
+    return max(1, -(-total // page_size))
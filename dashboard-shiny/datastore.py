@@ -0,0 +1,184 @@
+"""
+Loading and building of the dashboard dataset.
+
+Running this file converts FINAL_TEDX_DATASET_2024.csv into a typed columnar
+Feather file, which the dashboard loads instead of parsing the CSV:
+
+    python datastore.py
+"""
+
+import os
+import shutil
+import time
+from pathlib import Path
+
+import pandas as pd
+
+app_dir = Path(__file__).parent
+csv_path = app_dir / "FINAL_TEDX_DATASET_2024.csv"
+feather_path = app_dir / "FINAL_TEDX_DATASET_2024.feather"
+
+# Columns used by the dashboard, the remaining ones are never loaded
+dashboard_columns = [
+    "title",
+    "translated_title",
+    "speaker",
+    "event",
+    "year",
+    "views",
+    "language",
+    "category",
+    "sentiment",
+]
+
+categorical_columns = ["language", "other_language", "category", "sentiment"]
+integer_columns = {"year": "Int16", "views": "Int64"}
+string_columns = [
+    "original_string",
+    "full_title",
+    "title",
+    "speaker",
+    "event",
+    "event_organizer",
+    "date_str",
+    "date",
+    "translated_title",
+]
+
+
+def set_types(df):
+    """
+    Converts the columns of the raw CSV frame to compact dtypes:
+    categoricals for the low-cardinality labels and nullable integers
+    for year and views (views are missing for some talks).
+    """
+    for column in categorical_columns:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    for column, dtype in integer_columns.items():
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors="coerce").astype(dtype)
+    return df
+
+
+def read_csv(path=csv_path, columns=None):
+    dtype = {column: "str" for column in string_columns}
+    df = pd.read_csv(path, usecols=columns, dtype=dtype, low_memory=False)
+    return set_types(df)
+
+
+def is_feather_fresh(path=feather_path, source=csv_path):
+    if not path.exists():
+        return False
+    # The CSV may not be shipped next to the app, the Feather file is enough
+    return not source.exists() or path.stat().st_mtime >= source.stat().st_mtime
+
+
+def source_path():
+    """
+    Returns the file the dataset is loaded from.
+    """
+    return feather_path if is_feather_fresh() else csv_path
+
+
+def dataset_version():
+    """
+    Returns a token that changes whenever the dataset file changes,
+    used to invalidate everything derived from it.
+    """
+    stat = source_path().stat()
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def load_dataset(columns=dashboard_columns):
+    """
+    Loads the dataset from the Feather file when it is present and up to date,
+    falling back to parsing the CSV. Only the given columns are read.
+    """
+    if is_feather_fresh():
+        try:
+            return pd.read_feather(feather_path, columns=columns)
+        except ImportError:
+            # pyarrow is not installed
+            pass
+    return read_csv(csv_path, columns)
+
+
+def title_lengths(df):
+    """
+    Returns the length of the titles, precomputed in the shared dataset.
+    """
+    if "title_length" in df.columns:
+        return df["title_length"]
+    return df["title"].astype(str).str.len().astype("int16")
+
+
+def replace_file(path, write):
+    """
+    Calls write with a temporary path next to path, keeping its suffix for the
+    writers that choose the format from it, then renames it over path.
+    Readers never see a partial file.
+    """
+    path = Path(path)
+    partial = path.with_name(f"{path.stem}.{os.getpid()}.tmp{path.suffix}")
+    try:
+        write(partial)
+        os.replace(partial, path)
+    finally:
+        partial.unlink(missing_ok=True)
+
+
+def replace_directory(directory, write):
+    """
+    Calls write with a new version directory next to directory, then points
+    the directory symlink at it with a single rename, so that readers always
+    find a complete version. The previous version is kept until the next
+    replacement, for the readers opening it, the older ones are removed.
+    """
+    directory = Path(directory)
+    version_dir = directory.with_name(f"{directory.name}.{time.time_ns()}")
+    version_dir.mkdir(parents=True)
+    write(version_dir)
+
+    previous = None
+    if directory.is_symlink():
+        previous = directory.with_name(os.readlink(directory))
+    elif directory.exists():
+        # Directory written before the versions were kept side by side
+        shutil.rmtree(directory)
+    link = directory.with_name(f"{directory.name}.{os.getpid()}.link")
+    link.symlink_to(version_dir.name)
+    os.replace(link, directory)
+
+    for old in directory.parent.glob(f"{directory.name}.*"):
+        if old.is_dir() and not old.is_symlink() and old not in (version_dir, previous):
+            shutil.rmtree(old)
+
+
+def build_feather(source=csv_path, path=feather_path):
+    df = read_csv(source)
+    # Uncompressed, so that the file can be memory-mapped
+    df.to_feather(path, compression="uncompressed")
+    return df
+
+
+def main():
+    from aggregates import build_cube, cube_path, save_cube
+    from search_index import SearchIndex, search_index_dir
+    from term_index import TermIndex, term_index_path
+
+    df = build_feather()
+    print(f"Saved {len(df)} rows to {feather_path.name}")
+    cube = build_cube(df)
+    save_cube(cube)
+    print(f"Saved {len(cube)} aggregate rows to {cube_path.name}")
+    term_index = TermIndex.build(df)
+    term_index.save()
+    print(f"Saved {len(term_index.vocabulary)} terms to {term_index_path.name}")
+    search_index = SearchIndex.build(df)
+    search_index.save()
+    print(f"Saved {len(search_index.vocabulary)} words to {search_index_dir.name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Cache of rendered Plotly figures, shared by all sessions of the app process.
+
+Figures are keyed by the plot function, its normalized arguments, the
+dataset version and the source of the plotting module, so identical inputs
+are rendered only once. The figure objects are kept in memory and returned as
+they are. With a directory given, their JSON is also written to disk and
+survives restarts of the app.
+"""
+
+import hashlib
+import inspect
+import os
+import sys
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+import plotly.io as pio
+
+# Bumped by hand when the figures change without their module changing,
+# e.g. after a change of a helper module
+cache_format = 1
+
+
+@lru_cache(maxsize=None)
+def module_version(module_name):
+    """
+    Hash of the source of a module, None when it is not available.
+    """
+    try:
+        source = inspect.getsource(sys.modules[module_name])
+    except (KeyError, OSError, TypeError):
+        return None
+    return hashlib.sha1(source.encode()).hexdigest()
+
+
+def normalize(value):
+    """
+    Converts an argument to a hashable value with a stable repr,
+    e.g. the tuples and lists returned by the inputs become tuples.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(normalize(item) for item in value))
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize(item)) for key, item in value.items()))
+    if hasattr(value, "item"):
+        # numpy scalars
+        return value.item()
+    return value
+
+
+class FigureCache:
+    def __init__(self, version, max_size=256, directory=None):
+        self.version = version
+        self.max_size = max_size
+        self.directory = Path(directory) if directory else None
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.figures = OrderedDict()
+        self.lock = threading.Lock()
+
+    def key(self, func, args, kwargs):
+        return (
+            func.__module__,
+            func.__qualname__,
+            normalize(args),
+            normalize(kwargs),
+            self.version,
+            module_version(func.__module__),
+            cache_format,
+        )
+
+    def path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return self.directory / f"{digest}.json"
+
+    def get(self, func, data, *args, **kwargs):
+        """
+        Returns func(data, *args, **kwargs), rendering it only on a cache miss.
+        data is not part of the key, it has to be a dataset-level object
+        (such as the dataset or the cube) identified by the dataset version.
+        The figure is shared by all the callers, it must not be modified.
+        """
+        key = self.key(func, args, kwargs)
+
+        with self.lock:
+            figure = self.figures.get(key)
+            if figure is not None:
+                self.figures.move_to_end(key)
+                self.hits += 1
+                return figure
+
+        if self.directory and self.path(key).exists():
+            # Parsed once per process, then served from memory
+            figure = pio.from_json(self.path(key).read_text())
+            with self.lock:
+                self.disk_hits += 1
+            self.store(key, figure)
+            return figure
+
+        figure = func(data, *args, **kwargs)
+        with self.lock:
+            self.misses += 1
+        self.store(key, figure)
+        if self.directory:
+            # Written aside and renamed, other processes never read a partial file
+            path = self.path(key)
+            partial = path.with_suffix(f".{os.getpid()}.tmp")
+            partial.write_text(figure.to_json())
+            partial.replace(path)
+        return figure
+
+    def store(self, key, figure):
+        with self.lock:
+            self.figures[key] = figure
+            self.figures.move_to_end(key)
+            while len(self.figures) > self.max_size:
+                self.figures.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self.figures),
+            }
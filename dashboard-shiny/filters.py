@@ -0,0 +1,62 @@
+"""
+Filtering of the talks shown in the "Views correlation" plots.
+
+The columns the filters and the plots work on are computed once with
+build_views_frame, every change of the inputs then only evaluates one
+boolean mask over them.
+"""
+
+import pandas as pd
+
+from datastore import title_lengths
+from category_hierarchy import hierarchy
+
+views_columns = ["category", "views", "title_length", "sentiment"]
+
+
+def build_views_frame(df):
+    """
+    Precomputes the hierarchy code of the category, integer year and title
+    length of the talks that can be shown on the log-scale views axis.
+    """
+    frame = pd.DataFrame(
+        {
+            "category": hierarchy.codes(df["category"]),
+            "year": df["year"].fillna(0).astype("int16"),
+            "views": df["views"],
+            "title_length": title_lengths(df),
+            "language": df["language"],
+            "sentiment": df["sentiment"],
+        }
+    )
+
+    # Talks outside the hierarchy and talks without views are never plotted
+    keep = frame["category"].ge(0) & frame["views"].gt(0).fillna(False)
+    frame = frame[keep.to_numpy()]
+    frame["views"] = frame["views"].astype("int64")
+    return frame
+
+
+def filter_views(
+    frame,
+    start_date,
+    end_date,
+    selected_categories=None,
+    selected_lang="All Languages",
+    columns=views_columns,
+):
+    """
+    Returns the given columns of the talks from frame matching the filters.
+    selected_categories is a list of parent category names, all of them
+    are kept when it is empty.
+    """
+    year = frame["year"].to_numpy()
+    mask = (year >= start_date) & (year <= end_date)
+
+    if selected_categories:
+        mask &= hierarchy.in_parents(frame["category"].to_numpy(), selected_categories)
+
+    if selected_lang != "All Languages" and selected_lang is not None:
+        mask &= (frame["language"] == selected_lang).to_numpy()
+
+    return frame.loc[mask, columns]
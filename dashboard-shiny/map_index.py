@@ -0,0 +1,161 @@
+"""
+Grid clustering of the map markers, precomputed for every zoom level.
+
+At each zoom level the points are grouped into square grid cells about
+cluster_radius pixels wide, so the map only shows the clusters inside the
+current viewport instead of a marker per event organizer.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+
+tile_size = 256  # pixels of a map tile, spanning 360 / 2 ** zoom degrees
+
+
+class GridClusterIndex:
+    def __init__(
+        self, lat, lon, labels, label_ids=None, max_zoom=18, cluster_radius=60
+    ):
+        # Kept as given, e.g. float32 views of the memory-mapped companion
+        self.lat = np.asarray(lat)
+        self.lon = np.asarray(lon)
+        # Popup of each point, or a table of unique popups indexed by label_ids
+        self.labels = labels
+        self.label_ids = label_ids
+        self.levels = []
+        self.assignments = []
+
+        for zoom in range(max_zoom + 1):
+            level, assignment = self.cluster(360 / 2**zoom * cluster_radius / tile_size)
+            self.levels.append(level)
+            self.assignments.append(assignment)
+            if level["count"].max(initial=1) == 1:
+                # Every point is on its own, deeper zoom levels look the same
+                break
+
+    @classmethod
+    def from_geojson(cls, geojson_data, **kwargs):
+        features = geojson_data["features"]
+        coordinates = np.array(
+            [feature["geometry"]["coordinates"] for feature in features],
+            dtype="float64",
+        ).reshape(-1, 2)
+        labels = [feature["properties"]["popup"] for feature in features]
+        return cls(coordinates[:, 1], coordinates[:, 0], labels, **kwargs)
+
+    @classmethod
+    def from_arrays(cls, path, **kwargs):
+        """
+        Reads the binary companion of a markers.geojson file, the coordinates
+        and label ids are memory-mapped instead of parsed.
+        """
+        path = Path(path)
+        coordinates = np.load(path.with_suffix(".coords.npy"), mmap_mode="r")
+        label_ids = np.load(path.with_suffix(".label_ids.npy"), mmap_mode="r")
+        with open(path.with_suffix(".labels.json")) as f:
+            labels = json.load(f)["labels"]
+        return cls(coordinates[:, 0], coordinates[:, 1], labels, label_ids, **kwargs)
+
+    def label(self, point):
+        if self.label_ids is None:
+            return self.labels[point]
+        return self.labels[self.label_ids[point]]
+
+    def cluster(self, cell_size):
+        # Cast for this level only, the stored coordinates stay shared
+        lat = np.asarray(self.lat, dtype="float64")
+        lon = np.asarray(self.lon, dtype="float64")
+        cells = np.stack([np.floor(lat / cell_size), np.floor(lon / cell_size)], axis=1)
+        _, first, inverse, count = np.unique(
+            cells, axis=0, return_index=True, return_inverse=True, return_counts=True
+        )
+        inverse = inverse.ravel()
+        level = {
+            "cluster": np.arange(len(count)),
+            "lat": np.bincount(inverse, weights=lat) / count,
+            "lon": np.bincount(inverse, weights=lon) / count,
+            "count": count,
+            # The point shown when the cluster holds a single one
+            "point": first,
+        }
+        return level, inverse
+
+    def level_of(self, zoom):
+        return min(max(int(zoom), 0), len(self.levels) - 1)
+
+    def is_deepest(self, zoom):
+        return self.level_of(zoom) == len(self.levels) - 1
+
+    def members(self, zoom, cluster):
+        """
+        Returns the indices of the points in a cluster of the given zoom level.
+        """
+        return np.flatnonzero(self.assignments[self.level_of(zoom)] == cluster)
+
+    def query(self, south, west, north, east, zoom):
+        """
+        Returns the clusters of the given zoom level inside the bounds,
+        as a dict of cluster, lat, lon, count and point arrays.
+        """
+        level = self.levels[self.level_of(zoom)]
+        lat, lon = level["lat"], level["lon"]
+
+        mask = (lat >= south) & (lat <= north)
+        if east - west < 360:
+            # Longitudes of a panned map can go past +-180
+            west = (west + 180) % 360 - 180
+            east = (east + 180) % 360 - 180
+            if west <= east:
+                mask &= (lon >= west) & (lon <= east)
+            else:
+                mask &= (lon >= west) | (lon <= east)
+
+        return {name: values[mask] for name, values in level.items()}
+
+
+def source_fingerprint(path):
+    """
+    Size and SHA-1 of a file, which unlike its modification time survive a
+    checkout.
+    """
+    content = Path(path).read_bytes()
+    return {"size": len(content), "sha1": hashlib.sha1(content).hexdigest()}
+
+
+def companion_matches(path, labels_path):
+    """
+    Whether the binary companion was exported from the markers.geojson file
+    at path, by the fingerprint recorded in its labels table.
+    """
+    with open(labels_path) as f:
+        table = json.load(f)
+    if not isinstance(table, dict):
+        # Tables written before the fingerprint was recorded
+        return False
+    source = table["source"]
+    if source.get("size") != path.stat().st_size:
+        return False
+    return source == source_fingerprint(path)
+
+
+def load_markers(path):
+    """
+    Builds the index from the binary companion of the markers.geojson file at
+    path, falling back to the GeoJSON when the companion is missing or was
+    exported from another version of it.
+    """
+    path = Path(path)
+    companion = [
+        path.with_suffix(suffix)
+        for suffix in [".coords.npy", ".label_ids.npy", ".labels.json"]
+    ]
+    if all(file.exists() for file in companion) and (
+        not path.exists() or companion_matches(path, companion[-1])
+    ):
+        return GridClusterIndex.from_arrays(path)
+
+    with open(path) as f:
+        return GridClusterIndex.from_geojson(json.load(f))
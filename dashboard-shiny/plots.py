@@ -1,20 +1,26 @@
+import numpy as np
 import pandas as pd
 import plotly.express as px
 
-# from wordcloud import WordCloud
-# import matplotlib.pyplot as plt
+from category_hierarchy import hierarchy
+
+try:
+    from wordcloud import WordCloud
+except ImportError:
+    # Not available e.g. in shinylive, the static word clouds are used instead
+    WordCloud = None
 
 # Basic plots
 
 
-def line_plot_videos_views(df, selected_var):
+def line_plot_videos_views(cube, selected_var):
     if selected_var == "All categories" or selected_var is None:
-        videos_count = df.groupby("year").size()
-        avg_views = df.groupby("year")["views"].mean()
+        data = cube
     else:
-        videos_cat = df[df["category"] == selected_var]
-        videos_count = videos_cat.groupby("year").size()
-        avg_views = videos_cat.groupby("year")["views"].mean()
+        data = cube[cube["category"] == selected_var]
+    per_year = data.groupby("year")[["count", "views_sum", "views_count"]].sum()
+    videos_count = per_year["count"].rename(None)
+    avg_views = per_year["views_sum"] / per_year["views_count"]
 
     fig = px.bar(
         videos_count,
@@ -67,11 +73,16 @@ def line_plot_videos_views(df, selected_var):
     return fig
 
 
-def treemap_languages_plot(df, selected_var):
+def treemap_languages_plot(cube, selected_var):
     if selected_var == "All categories" or selected_var is None:
-        value_counts = df["language"].value_counts()
+        data = cube
     else:
-        value_counts = df[df["category"] == selected_var]["language"].value_counts()
+        data = cube[cube["category"] == selected_var]
+    value_counts = (
+        data.groupby("language", observed=True)["count"]
+        .sum()
+        .sort_values(ascending=False)
+    )
 
     total_count = value_counts.sum()
     percentages = (value_counts / total_count * 100).round(2)
@@ -103,93 +114,44 @@ def treemap_languages_plot(df, selected_var):
 
 
 def get_sunburst_mapping():
-    sunburst_mapping = {
-        "Human Experience": {
-            "Personal Growth": ["personal growth", "mental health", "psychology"],
-            "Health & Well-being": ["health", "nature"],
-            "Creativity & Arts": [
-                "creativity",
-                "art",
-                "music",
-                "design",
-                "entertainment",
-            ],
-            "Culture & Society": [
-                "culture",
-                "gender",
-                "social change",
-                "history",
-                "storytelling",
-            ],
-        },
-        "Knowledge & Education": {
-            "Literature & Communication": [
-                "literature",
-                "storytelling",
-                "communication",
-            ],
-            "Education & Learning": ["education", "innovation", "technology"],
-        },
-        "Global Issues": {
-            "Environment & Sustainability": [
-                "environment",
-                "climate change",
-                "sustainability",
-            ],
-            "Politics & Society": [
-                "politics",
-                "social change",
-                "global issues",
-                "humanity",
-            ],
-            "Economics & Work": ["economics", "business", "work"],
-        },
-        "Science & Technology": {
-            "Science & Exploration": ["science", "technology", "AI", "innovation"],
-            "Global Challenges": ["climate change", "sustainability", "global issues"],
-        },
-        "Lifestyle & Leisure": {
-            "Food & Entertainment": ["food", "entertainment", "design"],
-            "Leisure & Creativity": ["music"],  # Focused on music as part of leisure
-        },
-    }
-    return sunburst_mapping
+    return hierarchy.mapping
 
 
 def get_parent_categories():
-    sunburst_mapping = get_sunburst_mapping()
-    parent_categories = set()
-
-    for grandparent, subcategories in sunburst_mapping.items():
-        for parent in subcategories.keys():
-            parent_categories.add(parent)
+    return hierarchy.parents.tolist()
 
-    return list(parent_categories)
 
+def sunburst(cube):
+    # One row per category, plotly builds the path from plain strings only
+    counts = cube.groupby("category", observed=True)["count"].sum()
+    counts.index = counts.index.astype(object)
 
-def sunburst(df):
-    # Define the hierarchy for the sunburst diagram
-    sunburst_mapping = get_sunburst_mapping()
+    # Calculate percentage occurrence, weighted as when every talk
+    # contributed its category share as a separate row
+    percentage = counts**2 / (counts**2).sum() * 100
 
-    # Flatten the hierarchy to create a parent mapping
-    parent_mapping = {}
-    for grandparent, subcategories in sunburst_mapping.items():
-        for parent, children in subcategories.items():
-            for child in children:
-                parent_mapping[child] = parent
-            parent_mapping[parent] = grandparent
-
-    data = df.copy()
+    # A category with several parents is shown under each of them, split evenly
+    data = hierarchy.split(percentage).rename(
+        columns={"grandparent": "root", "value": "percentage"}
+    )
+    data = data[data["percentage"] > 0]
 
-    # Add parent and root columns to the data
+    # Categories outside the hierarchy hang from the root
     root = "All Categories"
-    data["parent"] = data["category"].map(parent_mapping).fillna(root)
-    data["root"] = data["parent"].map(parent_mapping).fillna(root)
-
-    # Calculate percentage occurrence
-    data_count = data.groupby(["category"]).size().reset_index(name="count")
-    data = data.merge(data_count, on="category")
-    data["percentage"] = (data["count"] / data["count"].sum()) * 100
+    outside = percentage[~percentage.index.isin(hierarchy.categories)]
+    data = pd.concat(
+        [
+            data,
+            pd.DataFrame(
+                {
+                    "root": root,
+                    "parent": root,
+                    "category": outside.index,
+                    "percentage": outside.to_numpy(),
+                }
+            ),
+        ]
+    )
 
     # Create a sunburst chart
     fig = px.sunburst(
@@ -215,30 +177,34 @@ def sunburst(df):
     return fig
 
 
-def sunburst_df(df):
-    sunburst_mapping = get_sunburst_mapping()
-    # Convert the hierarchy to a DataFrame
-    rows = []
-    for grandparent, subcategories in sunburst_mapping.items():
-        for parent, children in subcategories.items():
-            for child in children:
-                rows.append([grandparent, parent, child])
-
-    hierarchy_df = pd.DataFrame(rows, columns=["Grandparent", "Parent", "Child"])
-    data_count = df.groupby(["category"]).size().reset_index(name="count")
-    total_count = data_count["count"].sum()
-    hierarchy_df = pd.merge(
-        hierarchy_df, data_count, how="left", left_on="Child", right_on="category"
+def sunburst_df(cube):
+    counts = cube.groupby("category", observed=True)["count"].sum()
+    total_count = counts.sum()
+    # count is the number of talks of the category under every parent, the
+    # percentage of a category with several parents is split between them so
+    # that the percentages add up
+    hierarchy_df = hierarchy.split(counts)
+    hierarchy_df = pd.DataFrame(
+        {
+            "Grandparent": hierarchy_df["grandparent"],
+            "Parent": hierarchy_df["parent"],
+            "Child": hierarchy_df["category"],
+            "count": (hierarchy_df["value"] / hierarchy_df["weight"])
+            .round()
+            .astype("int64"),
+            "percentage": round((hierarchy_df["value"] / total_count) * 100, 2),
+        }
     )
-    hierarchy_df["count"] = hierarchy_df["count"].fillna(0)
-    hierarchy_df["percentage"] = round((hierarchy_df["count"] / total_count) * 100, 2)
-    hierarchy_df.drop(columns=["category"], inplace=True)
     return hierarchy_df
 
 
-def category_popularity_over_time(df, selected_category=None):
+def category_popularity_over_time(cube, selected_category=None):
     # Group data by year and category, summing the views
-    category_time = df.groupby(["year", "category"])["views"].sum().reset_index()
+    category_time = (
+        cube.groupby(["year", "category"], observed=True)["views_sum"]
+        .sum()
+        .reset_index(name="views")
+    )
 
     # Create an area plot using Plotly Express
     fig = px.area(
@@ -283,32 +249,30 @@ def category_popularity_over_time(df, selected_category=None):
 
 # Wordcloud
 
-# # This sadly does not work in the current environment, as matplotlib is not supported
+# The image is saved directly, as matplotlib figures are not supported
+# in the current environment
+
 
-# def wordcloud_plot(df, selected_var):
-#     if selected_var == "All categories" or selected_var is None:
-#         data = df.copy()
-#     else:
-#         data = df[df['category'] == selected_var]
+def wordcloud_image(frequencies, path):
+    wordcloud = WordCloud(width=800, height=400, background_color="white")
+    wordcloud.generate_from_frequencies(frequencies).to_file(path)
+    return path
 
-#     wordcloud = WordCloud(width=800, height=400, background_color='white').generate(' '.join(data['translated_title'].dropna()))
-#     plt.figure(figsize=(10, 5))
-#     plt.imshow(wordcloud, interpolation='bilinear')
-#     plt.axis('off')
-#     return plt
 
 # Sentiment
 
 
-def sentiment_analysis_plot(df, selected_var):
+def sentiment_analysis_plot(cube, selected_var):
     if selected_var == "All categories" or selected_var is None:
-        df = df
+        data = cube
         title_var = "Sentiment Percentage per Year"
     else:
-        df = df[df["category"] == selected_var]
+        data = cube[cube["category"] == selected_var]
         title_var = f"Sentiment Percentage per Year for {selected_var}"
     # Normalize the counts to percentages
-    sentiment_counts = df.groupby(["year", "sentiment"]).size().unstack()
+    sentiment_counts = (
+        data.groupby(["year", "sentiment"], observed=True)["count"].sum().unstack()
+    )
 
     sentiment_percentages = (
         sentiment_counts.div(sentiment_counts.sum(axis=1), axis=0) * 100
@@ -351,45 +315,21 @@ def sentiment_analysis_plot(df, selected_var):
 # Views
 
 
-def log_scale_boxplot_by_categories(
-    df, start_date, end_date, selected_categories=None, selected_lang="All Languages"
-):
+def log_scale_boxplot_by_categories(data, selected_categories=None):
     """
-    selected_categories is a list of parent category names from the df
-    that the user selected in a multiple choice input.
+    data holds the talks matching the Views correlation filters,
+    as returned by filters.filter_views. A talk is shown under every
+    selected parent of its category.
     """
-
-    sunburst_mapping = get_sunburst_mapping()
-
-    # Flatten the hierarchy to map each category to its parent
-    parent_map = {}
-    for grandparent, subcategories in sunburst_mapping.items():
-        for parent, children in subcategories.items():
-            for child in children:
-                parent_map[child] = parent
-            parent_map[parent] = parent
-
-    data = df.copy()
-    data["parent"] = data["category"].map(parent_map).dropna()
-
-    # Category filter
-    if selected_categories:
-        data = data[data["parent"].isin(selected_categories)]
-    else:
-        data = data[data["parent"].notnull()]
-
-    # Language filter
-    if selected_lang == "All Languages":
-        data = data
-    else:
-        data = data[data["language"] == selected_lang]
-
-    # Year filter
-    data["year"] = pd.to_numeric(data["year"], errors="coerce")
-    data = data[(data["year"] >= start_date) & (data["year"] <= end_date)]
-
-    data = data.dropna(subset=["views"])  # Remove missing values
-    data = data[data["views"] > 0]  # Remove zero or negative views
+    rows, parents, _ = hierarchy.memberships(
+        data["category"].to_numpy(), selected_categories or None
+    )
+    data = pd.DataFrame(
+        {
+            "parent": hierarchy.parents[parents],
+            "views": data["views"].to_numpy()[rows],
+        }
+    )
 
     fig = px.box(
         data,
@@ -414,56 +354,70 @@ def log_scale_boxplot_by_categories(
     return fig
 
 
+# Larger selections are downsampled before plotting, to keep the figure small
+scatter_max_points = 20000
+
+
+def sample_by_sentiment(data, max_points, outlier_share=0.1, random_state=0):
+    """
+    Samples at most max_points talks, keeping the share of each sentiment.
+    Within each sentiment the talks furthest from the median views and title
+    length are always kept, so that the outliers stay visible.
+    """
+    groups = data.groupby("sentiment", observed=True)
+    # Largest remainder allocation, the quotas add up to max_points exactly
+    shares = groups.size() * max_points / len(data)
+    quotas = np.floor(shares).astype(int)
+    remainder = min(max_points, len(data)) - quotas.sum()
+    quotas[(shares - quotas).sort_values(ascending=False).index[:remainder]] += 1
+
+    parts = []
+    for sentiment, group in groups:
+        quota = quotas[sentiment]
+        if len(group) <= quota:
+            parts.append(group)
+            continue
+
+        # Distance from the median in both dimensions, scaled by the IQR
+        score = np.zeros(len(group))
+        for values in [np.log10(group["views"]), group["title_length"]]:
+            values = values.to_numpy(dtype="float64")
+            q1, median, q3 = np.percentile(values, [25, 50, 75])
+            score += np.abs(values - median) / max(q3 - q1, 1)
+
+        n_outliers = int(quota * outlier_share)
+        order = np.argsort(score)
+        outliers = group.iloc[order[len(group) - n_outliers :]]
+        rest = group.iloc[order[: len(group) - n_outliers]].sample(
+            quota - n_outliers, random_state=random_state
+        )
+        parts += [outliers, rest]
+
+    return pd.concat(parts).sort_index()
+
+
 def views_vs_title_length_plot(
-    df, start_date, end_date, selected_categories=None, selected_lang="All Languages"
+    data, selected_lang="All Languages", max_points=scatter_max_points
 ):
     """
     Creates a scatter plot showing the correlation between title length
-    and the number of views, with sentiment as colors, for the selected filters.
+    and the number of views, with sentiment as colors, for the talks matching
+    the filters (as returned by filters.filter_views).
+    Selections larger than max_points are downsampled with sample_by_sentiment.
     """
-    sunburst_mapping = get_sunburst_mapping()
-
-    # Flatten the hierarchy to map each category to its parent
-    parent_map = {}
-    for grandparent, subcategories in sunburst_mapping.items():
-        for parent, children in subcategories.items():
-            for child in children:
-                parent_map[child] = parent
-            parent_map[parent] = parent
-
-    data = df.copy()
-    data["parent"] = data["category"].map(parent_map).dropna()
-
-    # Category filter
-    if selected_categories:
-        data = data[data["parent"].isin(selected_categories)]
-    else:
-        data = data[data["parent"].notnull()]
-        op = 0.05
-
-    # Language filter
     op = 0.05  # default opacity
-    if selected_lang != "All Languages" and selected_lang is not None:
-        data = data[data["language"] == selected_lang]
-        if selected_lang != "en":
-            op = 1  # Change the alpha value for transparency for clearer visualization
+    if selected_lang not in ("All Languages", "en", None):
+        op = 1  # Change the alpha value for transparency for clearer visualization
 
-    # Year filter
-    data["year"] = pd.to_numeric(data["year"], errors="coerce")
-    data = data[(data["year"] >= start_date) & (data["year"] <= end_date)]
+    # Ensure sentiment column is present and remove the specific point
+    # with title length of 116, as this is most likely and error
+    data = data[data["sentiment"].notna() & (data["title_length"] != 116)]
 
-    # Remove missing or non-positive views
-    data = data.dropna(subset=["views"])
-    data = data[data["views"] > 0]
-
-    # Calculate title length
-    data["title_length"] = data["title"].apply(lambda x: len(str(x)))
-
-    # Ensure sentiment column is present
-    data = data.dropna(subset=["sentiment"])
-
-    # Remove the specific point with title length of 116, as this is most likely and error
-    data = data[data["title_length"] != 116]
+    total = len(data)
+    if max_points is not None and total > max_points:
+        data = sample_by_sentiment(data, max_points)
+        # Keep the apparent density of the full selection
+        op = min(1, op * total / len(data))
 
     # Define custom color mapping
     color_map = {"Positive": "green", "Neutral": "gray", "Negative": "red"}
@@ -491,4 +445,13 @@ def views_vs_title_length_plot(
             font_weight="bold",
         ),
     )
+    if len(data) < total:
+        fig.add_annotation(
+            text=f"Showing a sample of {len(data):,} out of {total:,} talks",
+            xref="paper",
+            yref="paper",
+            x=1,
+            y=1.02,
+            showarrow=False,
+        )
     return fig
@@ -0,0 +1,74 @@
+"""
+Rate limiting of reactive values, for inputs changing faster than the plots
+depending on them can be rendered.
+
+debounce waits until the value has not changed for a delay, throttle lets at
+most one change through per interval. Both only notify their dependents when
+the value differs from the last one they returned, so intermediate slider
+positions are never rendered and moving a slider back and forth is free.
+"""
+
+import time
+
+from shiny import reactive, req
+
+
+def rate_limited(f, delay_secs, throttle=False):
+    # Latest value of f, evaluated eagerly so that its changes are noticed
+    @reactive.calc
+    def latest():
+        return f()
+
+    deadline = reactive.Value(None)
+    trigger = reactive.Value(0)
+    emitted = {}
+
+    @reactive.effect(priority=102)
+    def schedule():
+        latest()
+        with reactive.isolate():
+            if "value" not in emitted:
+                # The first value is not delayed
+                deadline.set(time.monotonic())
+            elif not throttle or deadline.get() is None:
+                deadline.set(time.monotonic() + delay_secs)
+
+    @reactive.effect(priority=101)
+    def release():
+        when = deadline.get()
+        if when is None:
+            return
+        remaining = when - time.monotonic()
+        if remaining > 0:
+            reactive.invalidate_later(remaining)
+            return
+        with reactive.isolate():
+            deadline.set(None)
+            value = latest()
+            if emitted.get("value", object()) != value:
+                emitted["value"] = value
+                trigger.set(trigger.get() + 1)
+
+    @reactive.calc
+    @reactive.event(trigger, ignore_none=False)
+    def limited():
+        req("value" in emitted)
+        return emitted["value"]
+
+    return limited
+
+
+def debounce(delay_secs):
+    """
+    Returns a decorator turning a function of reactive inputs into a calc
+    updated once the inputs have been still for delay_secs.
+    """
+    return lambda f: rate_limited(f, delay_secs)
+
+
+def throttle(delay_secs):
+    """
+    Returns a decorator turning a function of reactive inputs into a calc
+    updated at most once every delay_secs while the inputs keep changing.
+    """
+    return lambda f: rate_limited(f, delay_secs, throttle=True)
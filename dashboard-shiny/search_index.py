@@ -0,0 +1,264 @@
+"""
+Inverted index of the titles, speakers and events, for the Search tab.
+
+Every word of the searched columns points to the sorted rows containing it,
+so a query is an intersection of a few posting lists instead of a scan of the
+dataset. The words are also indexed by their trigrams, which finds misspelled
+words. The arrays are stored as .npy files and memory-mapped when loaded.
+"""
+
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from datastore import app_dir, replace_directory, source_path
+
+search_index_dir = app_dir / "FINAL_TEDX_DATASET_2024_search"
+search_columns = ["title", "translated_title", "speaker", "event"]
+token_pattern = r"\w+"
+# Combining marks left by the NFKD decomposition, "Kraków" is found by "krakow"
+accent_pattern = r"[\u0300-\u036f]"
+# Letters without a decomposition, "Żółć" is found by "zolc"
+unfolded_letters = str.maketrans({"ł": "l", "Ł": "L"})
+# Bumped when the normalization changes, older indexes are rebuilt
+index_format = 2
+# Words are stored as fixed-width UTF-8 bytes, longer ones are truncated
+max_term_bytes = 32
+array_names = [
+    "vocabulary",
+    "term_offsets",
+    "posting_rows",
+    "trigrams",
+    "trigram_offsets",
+    "trigram_terms",
+    "term_trigram_counts",
+]
+
+
+def normalize(texts):
+    return (
+        texts.str.lower()
+        .str.translate(unfolded_letters)
+        .str.normalize("NFKD")
+        .str.replace(accent_pattern, "", regex=True)
+    )
+
+
+def tokenize(text):
+    return re.findall(token_pattern, normalize(pd.Series([text]))[0])
+
+
+def encode_terms(terms, width=max_term_bytes):
+    return np.array([term.encode("utf-8")[:width] for term in terms], dtype=f"S{width}")
+
+
+def term_trigrams(term):
+    padded = f" {term} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def csr(keys, values, n_keys):
+    """
+    Returns the offsets and values of the lists of values of each key, keys
+    sorted.
+    """
+    offsets = np.zeros(n_keys + 1, dtype="int64")
+    np.cumsum(np.bincount(keys, minlength=n_keys), out=offsets[1:])
+    return offsets, values
+
+
+class SearchIndex:
+    def __init__(
+        self,
+        vocabulary,
+        term_offsets,
+        posting_rows,
+        trigrams,
+        trigram_offsets,
+        trigram_terms,
+        term_trigram_counts,
+    ):
+        # Sorted words and, for each, its slice of posting_rows
+        self.vocabulary = vocabulary
+        self.term_offsets = term_offsets
+        self.posting_rows = posting_rows
+        # Sorted trigrams and, for each, its slice of trigram_terms
+        self.trigrams = trigrams
+        self.trigram_offsets = trigram_offsets
+        self.trigram_terms = trigram_terms
+        self.term_trigram_counts = term_trigram_counts
+
+    @classmethod
+    def build(cls, df):
+        tokens = pd.concat(
+            [
+                normalize(df[column].fillna("").astype(str))
+                .str.findall(token_pattern)
+                .set_axis(np.arange(len(df)))
+                .explode()
+                .dropna()
+                for column in search_columns
+                if column in df.columns
+            ]
+        )
+        terms = tokens.str.encode("utf-8").str[:max_term_bytes]
+        term_ids, vocabulary = pd.factorize(terms, sort=True)
+        postings = pd.DataFrame({"term": term_ids, "row": tokens.index})
+        postings = postings.drop_duplicates().sort_values(["term", "row"])
+        term_offsets, posting_rows = csr(
+            postings["term"].to_numpy(),
+            postings["row"].to_numpy(dtype="int32"),
+            len(vocabulary),
+        )
+
+        trigram_lists = [
+            term_trigrams(term.decode("utf-8", errors="ignore")) for term in vocabulary
+        ]
+        pairs = pd.DataFrame(
+            {
+                "trigram": [t for trigrams in trigram_lists for t in trigrams],
+                "term": np.repeat(
+                    np.arange(len(vocabulary), dtype="int32"),
+                    [len(trigrams) for trigrams in trigram_lists],
+                ),
+            }
+        )
+        trigram_ids, trigrams = pd.factorize(pairs["trigram"], sort=True)
+        order = np.lexsort((pairs["term"].to_numpy(), trigram_ids))
+        trigram_offsets, trigram_terms = csr(
+            trigram_ids[order], pairs["term"].to_numpy()[order], len(trigrams)
+        )
+        return cls(
+            np.asarray(vocabulary, dtype=f"S{max_term_bytes}"),
+            term_offsets,
+            posting_rows,
+            encode_terms(trigrams, width=12),
+            trigram_offsets,
+            trigram_terms,
+            np.array([len(trigrams) for trigrams in trigram_lists], dtype="int16"),
+        )
+
+    def save(self, directory=search_index_dir):
+        """
+        Writes the arrays to a new version of directory, workers never map a
+        partial or truncated file.
+        """
+
+        def write(version_dir):
+            for name in array_names:
+                np.save(version_dir / f"{name}.npy", getattr(self, name))
+            (version_dir / "format.json").write_text(json.dumps(index_format))
+
+        replace_directory(directory, write)
+
+    @classmethod
+    def load(cls, directory=search_index_dir):
+        # All the arrays are read from the version the symlink points to now
+        directory = Path(directory).resolve()
+        return cls(
+            *(np.load(directory / f"{name}.npy", mmap_mode="r") for name in array_names)
+        )
+
+    def postings(self, term_ids):
+        """
+        Returns the sorted rows containing any of the terms.
+        """
+        offsets = self.term_offsets
+        lists = [
+            self.posting_rows[offsets[term] : offsets[term + 1]] for term in term_ids
+        ]
+        if len(lists) == 1:
+            return lists[0]
+        return np.unique(np.concatenate(lists))
+
+    def exact_terms(self, token):
+        key = encode_terms([token])[0]
+        position = np.searchsorted(self.vocabulary, key)
+        if position < len(self.vocabulary) and self.vocabulary[position] == key:
+            return [position]
+        return []
+
+    def prefix_terms(self, token, max_terms=500):
+        key = encode_terms([token])[0]
+        start = np.searchsorted(self.vocabulary, key)
+        # The smallest key larger than all the words starting with the prefix
+        end = np.searchsorted(self.vocabulary, key + b"\xff")
+        return list(range(start, min(end, start + max_terms)))
+
+    def fuzzy_terms(self, token, min_similarity=0.5):
+        """
+        Returns the words sharing enough trigrams with the token, by the Dice
+        coefficient of their trigram sets.
+        """
+        trigrams = term_trigrams(token)
+        keys = encode_terms(trigrams, width=12)
+        positions = np.searchsorted(self.trigrams, keys)
+        found = positions < len(self.trigrams)
+        positions = positions[found][self.trigrams[positions[found]] == keys[found]]
+        if not len(positions):
+            return []
+        offsets = self.trigram_offsets
+        candidates = np.concatenate(
+            [
+                self.trigram_terms[offsets[position] : offsets[position + 1]]
+                for position in positions
+            ]
+        )
+        terms, shared = np.unique(candidates, return_counts=True)
+        similarity = 2 * shared / (len(trigrams) + self.term_trigram_counts[terms])
+        return terms[similarity >= min_similarity].tolist()
+
+    def search(self, query, fuzzy=True, prefix=True):
+        """
+        Returns the sorted rows containing all the words of the query. The
+        last word also matches the words it starts, and a word missing from
+        the index matches the words spelled alike when fuzzy is set.
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return np.empty(0, dtype="int32")
+
+        row_sets = []
+        for i, token in enumerate(tokens):
+            term_ids = self.exact_terms(token)
+            if prefix and i == len(tokens) - 1 and len(token) >= 3:
+                term_ids = self.prefix_terms(token)
+            if not term_ids and fuzzy and len(token) >= 4:
+                term_ids = self.fuzzy_terms(token)
+            if not term_ids:
+                return np.empty(0, dtype="int32")
+            row_sets.append(self.postings(term_ids))
+
+        row_sets.sort(key=len)
+        rows = row_sets[0]
+        for other in row_sets[1:]:
+            rows = rows[np.isin(rows, other, assume_unique=True)]
+        return np.asarray(rows)
+
+
+def load_search_index(df):
+    """
+    Reads the persisted index, rebuilding it from df when it is missing, older
+    than the dataset file or built with another normalization.
+    """
+    # Judged and loaded on the same complete version
+    directory = search_index_dir.resolve()
+    files = [directory / f"{name}.npy" for name in array_names]
+    format_file = directory / "format.json"
+    if (
+        all(file.exists() for file in files + [format_file])
+        and json.loads(format_file.read_text()) == index_format
+        and min(file.stat().st_mtime for file in files)
+        >= source_path().stat().st_mtime
+    ):
+        return SearchIndex.load(directory)
+
+    search_index = SearchIndex.build(df)
+    try:
+        search_index.save()
+    except OSError:
+        pass
+    return search_index
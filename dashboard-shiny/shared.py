@@ -1,17 +1,79 @@
 from pathlib import Path
 
 from shiny import ui
-import pandas as pd
-import json
+from functools import lru_cache
+import hashlib
+import numpy as np
+import os
+import tempfile
 
-dtype = {
-    "translated_title": "str",
-}
+from datastore import load_dataset, dataset_version, replace_file
+from shared_dataset import attach
+from aggregates import load_cube
+from filters import build_views_frame
+from figure_cache import FigureCache
+from map_index import load_markers
+from term_index import load_term_index
+from search_index import load_search_index
+from data_browser import DataBrowser
+from plots import WordCloud, wordcloud_image
 
 app_dir = Path(__file__).parent
-df = pd.read_csv(app_dir / "FINAL_TEDX_DATASET_2024.csv", dtype=dtype, low_memory=False)
-with open(app_dir / "markers.geojson") as f:
-    geojson_data = json.load(f)
+# Set TEDX_SHARED_DATASET to attach to the columns published by shared_dataset.py
+shared_dataset = attach()
+if shared_dataset is not None:
+    df = shared_dataset.frame()
+    take_rows = shared_dataset.take
+else:
+    df = load_dataset()
+
+    def take_rows(rows, columns):
+        return df.iloc[rows][columns]
+
+cube = load_cube(df)
+views_frame = build_views_frame(df)
+# Set FIGURE_CACHE_DIR to keep the rendered figures across restarts
+figure_cache = FigureCache(
+    dataset_version(), directory=os.environ.get("FIGURE_CACHE_DIR")
+)
+marker_index = load_markers(app_dir / "markers.geojson")
+
+term_index = load_term_index(df) if WordCloud is not None else None
+search_index = load_search_index(df)
+search_views = df["views"].fillna(-1).to_numpy(dtype="int64")
+search_columns = ["title", "speaker", "event", "year", "views", "language", "category"]
+data_browser = DataBrowser(df, take_rows)
+wordcloud_dir = Path(tempfile.gettempdir()) / f"tedx-wordclouds-{dataset_version()}"
+
+
+@lru_cache(maxsize=256)
+def get_wordcloud(category, start_year, end_year, language, sentiment):
+    """
+    Returns the path of the word cloud image of the titles matching the filters,
+    rendering it on the first request. None when no title matches.
+    """
+    frequencies = term_index.frequencies(
+        category, start_year, end_year, language, sentiment
+    )
+    if not frequencies:
+        return None
+
+    key = repr((category, start_year, end_year, language, sentiment))
+    path = wordcloud_dir / f"{hashlib.sha1(key.encode()).hexdigest()}.png"
+    if not path.exists():
+        wordcloud_dir.mkdir(parents=True, exist_ok=True)
+        # Other workers may serve the same image, it is renamed into place
+        replace_file(path, lambda partial: wordcloud_image(frequencies, partial))
+    return str(path)
+
+
+@lru_cache(maxsize=128)
+def search_talks(query, fuzzy=True):
+    """
+    Returns the rows of the talks matching the query, the most viewed first.
+    """
+    rows = search_index.search(query, fuzzy=fuzzy)
+    return rows[np.argsort(-search_views[rows], kind="stable")]
 
 
 def show_category_notification():
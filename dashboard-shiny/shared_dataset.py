@@ -0,0 +1,206 @@
+"""
+Dataset columns shared by the dashboard worker processes.
+
+Running this file publishes the typed columns of the dataset as memory-mapped
+.npy files, after refreshing the cube and the indexes built from it:
+
+    python shared_dataset.py
+    TEDX_SHARED_DATASET=1 uvicorn app:app --workers 8
+
+Workers started with TEDX_SHARED_DATASET set (to 1 or to the published
+directory) attach to the files read-only instead of loading the dataset, so
+the operating system keeps a single copy of the columns in its page cache for
+all of them. Numbers and categories are used in place, the strings are only
+decoded for the rows a page shows.
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from datastore import (
+    app_dir,
+    dataset_version,
+    load_dataset,
+    replace_directory,
+    title_lengths,
+)
+
+shared_dir = app_dir / "FINAL_TEDX_DATASET_2024_shared"
+
+
+def write_column(directory, name, series):
+    """
+    Saves the arrays of one column and returns its description.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        np.save(directory / f"{name}.codes.npy", series.cat.codes.to_numpy())
+        return {"kind": "category", "categories": series.cat.categories.tolist()}
+
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        # Nullable numbers are stored as their values and missing mask, plain
+        # floats keep their NaN so that they are read back without the mask
+        numpy_dtype = getattr(series.dtype, "numpy_dtype", series.dtype)
+        plain_float = numpy_dtype.kind == "f" and numpy_dtype is series.dtype
+        na_value = np.nan if plain_float else 0
+        values = series.to_numpy(dtype=numpy_dtype, na_value=na_value)
+        np.save(directory / f"{name}.values.npy", values)
+        np.save(directory / f"{name}.mask.npy", series.isna().to_numpy())
+        return {"kind": "number", "dtype": str(series.dtype)}
+
+    # Strings are concatenated as UTF-8 with the offset of each row
+    missing = series.isna().to_numpy()
+    encoded = [
+        b"" if is_missing else str(value).encode("utf-8")
+        for value, is_missing in zip(series.to_numpy(dtype=object), missing)
+    ]
+    offsets = np.zeros(len(encoded) + 1, dtype="int64")
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    np.save(directory / f"{name}.data.npy", np.frombuffer(b"".join(encoded), "uint8"))
+    np.save(directory / f"{name}.offsets.npy", offsets)
+    np.save(directory / f"{name}.mask.npy", missing)
+    return {"kind": "string"}
+
+
+def publish(df, directory=shared_dir):
+    """
+    Writes the columns of df and the title lengths to a new version of
+    directory. Attached workers keep reading the files they opened until they
+    restart.
+    """
+    df = df.assign(title_length=title_lengths(df))
+    meta = {"version": dataset_version(), "n_rows": len(df), "columns": {}}
+
+    def write(version_dir):
+        for name in df.columns:
+            meta["columns"][name] = write_column(version_dir, name, df[name])
+        (version_dir / "meta.json").write_text(json.dumps(meta))
+
+    replace_directory(directory, write)
+
+
+class SharedFrame:
+    """
+    Read-only columns of a published dataset. All the files are opened when
+    it is created, so a later publish does not change what it reads.
+    """
+
+    parts = {
+        "category": ["codes"],
+        "number": ["values", "mask"],
+        "string": ["data", "offsets", "mask"],
+    }
+
+    def __init__(self, directory=shared_dir):
+        # The version the symlink points to now
+        self.directory = Path(directory).resolve()
+        meta = json.loads((self.directory / "meta.json").read_text())
+        self.version = meta["version"]
+        self.n_rows = meta["n_rows"]
+        self.meta = meta["columns"]
+        self.columns = list(self.meta)
+        self.arrays = {
+            (name, part): np.load(self.directory / f"{name}.{part}.npy", mmap_mode="r")
+            for name, column in self.meta.items()
+            for part in self.parts[column["kind"]]
+        }
+
+    def __len__(self):
+        return self.n_rows
+
+    def array(self, name, part):
+        return self.arrays[name, part]
+
+    def is_string(self, name):
+        return self.meta[name]["kind"] == "string"
+
+    def column(self, name):
+        """
+        Returns a number or category column backed by the shared files.
+        """
+        meta = self.meta[name]
+        if meta["kind"] == "category":
+            dtype = pd.CategoricalDtype(meta["categories"])
+            return pd.Series(
+                pd.Categorical.from_codes(self.array(name, "codes"), dtype=dtype),
+                name=name,
+            )
+        if meta["kind"] == "number":
+            values = self.array(name, "values")
+            dtype = pd.api.types.pandas_dtype(meta["dtype"])
+            if isinstance(dtype, pd.api.extensions.ExtensionDtype):
+                array_type = dtype.construct_array_type()
+                values = array_type(values, self.array(name, "mask"))
+            return pd.Series(values, name=name, copy=False)
+        raise KeyError(f"{name} is a string column, read its rows with take")
+
+    def frame(self):
+        """
+        Returns the number and category columns as a DataFrame, without
+        copying them.
+        """
+        names = [name for name in self.columns if not self.is_string(name)]
+        return pd.DataFrame({name: self.column(name) for name in names}, copy=False)
+
+    def strings(self, name, rows):
+        data = self.array(name, "data")
+        offsets = self.array(name, "offsets")
+        missing = self.array(name, "mask")
+        return [
+            None
+            if missing[row]
+            else bytes(data[offsets[row] : offsets[row + 1]]).decode("utf-8")
+            for row in rows
+        ]
+
+    def take(self, rows, columns):
+        """
+        Returns the given rows and columns as a small DataFrame.
+        """
+        rows = np.asarray(rows)
+        return pd.DataFrame(
+            {
+                name: self.strings(name, rows)
+                if self.is_string(name)
+                else self.column(name).iloc[rows].array
+                for name in columns
+            },
+            index=rows,
+        )
+
+
+def attach(directory=None):
+    """
+    Returns the published dataset when TEDX_SHARED_DATASET is set, None
+    otherwise. Fails when the dataset changed since it was published.
+    """
+    directory = directory or os.environ.get("TEDX_SHARED_DATASET")
+    if not directory:
+        return None
+    shared = SharedFrame(shared_dir if directory == "1" else directory)
+    if shared.version != dataset_version():
+        raise RuntimeError(
+            f"{shared.directory} is outdated, run python shared_dataset.py again"
+        )
+    return shared
+
+
+def main():
+    from aggregates import load_cube
+    from search_index import load_search_index
+    from term_index import load_term_index
+
+    df = load_dataset()
+    # Workers only read these, they have to be up to date
+    load_cube(df)
+    load_term_index(df)
+    load_search_index(df)
+    publish(df)
+    print(f"Published {len(df)} rows to {shared_dir.name}")
+
+
+if __name__ == "__main__":
+    main()
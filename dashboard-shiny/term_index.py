@@ -0,0 +1,155 @@
+"""
+Term-frequency index of the translated titles, for the word clouds.
+
+The word counts are stored as a sparse vector per (category, year, language,
+sentiment) group, so the frequencies for any combination of filters are the
+sum of the vectors of the matching groups, without going through the titles.
+"""
+
+import numpy as np
+import pandas as pd
+
+from datastore import app_dir, replace_file, source_path
+
+term_index_path = app_dir / "FINAL_TEDX_DATASET_2024_terms.npz"
+group_keys = ["category", "year", "language", "sentiment"]
+token_pattern = r"[a-z][a-z']+"
+
+
+def get_stopwords():
+    try:
+        from wordcloud import STOPWORDS
+    except ImportError:
+        return set()
+    return set(STOPWORDS)
+
+
+class TermIndex:
+    def __init__(self, vocabulary, groups, group_ids, term_ids, counts):
+        self.vocabulary = vocabulary
+        self.groups = groups
+        # One entry per (group, term) pair with a non-zero count
+        self.group_ids = group_ids
+        self.term_ids = term_ids
+        self.counts = counts
+
+    @classmethod
+    def build(cls, df, stopwords=None):
+        if stopwords is None:
+            stopwords = get_stopwords()
+
+        keys = pd.DataFrame(
+            {key: df[key].astype(str).where(df[key].notna(), "") for key in group_keys}
+        )
+        keys["year"] = df["year"].fillna(0).astype("int16")
+        row_groups = keys.groupby(group_keys, sort=True).ngroup()
+        groups = keys.drop_duplicates().sort_values(group_keys, ignore_index=True)
+
+        tokens = (
+            df["translated_title"]
+            .fillna("")
+            .str.lower()
+            .str.findall(token_pattern)
+            .explode()
+            .dropna()
+        )
+        tokens = tokens[~tokens.isin(stopwords)]
+        term_ids, vocabulary = pd.factorize(tokens, sort=True)
+
+        pairs = pd.DataFrame(
+            {"group": row_groups.loc[tokens.index].to_numpy(), "term": term_ids}
+        )
+        counts = pairs.value_counts(sort=False).sort_index()
+        return cls(
+            np.asarray(vocabulary, dtype=str),
+            groups,
+            counts.index.get_level_values("group").to_numpy(dtype="int32"),
+            counts.index.get_level_values("term").to_numpy(dtype="int32"),
+            counts.to_numpy(dtype="int32"),
+        )
+
+    def save(self, path=term_index_path):
+        replace_file(path, self.write)
+
+    def write(self, path):
+        np.savez(
+            path,
+            vocabulary=self.vocabulary,
+            group_ids=self.group_ids,
+            term_ids=self.term_ids,
+            counts=self.counts,
+            **{
+                f"group_{key}": self.groups[key].to_numpy(
+                    dtype="int16" if key == "year" else str
+                )
+                for key in group_keys
+            },
+        )
+
+    @classmethod
+    def load(cls, path=term_index_path):
+        with np.load(path) as data:
+            groups = pd.DataFrame({key: data[f"group_{key}"] for key in group_keys})
+            return cls(
+                data["vocabulary"],
+                groups,
+                data["group_ids"],
+                data["term_ids"],
+                data["counts"],
+            )
+
+    def frequencies(
+        self,
+        category=None,
+        start_year=None,
+        end_year=None,
+        language=None,
+        sentiment=None,
+        max_words=200,
+    ):
+        """
+        Returns a dict of the most frequent words in the titles matching
+        the filters, None filters match everything.
+        """
+        mask = np.ones(len(self.groups), dtype=bool)
+        for key, value in [
+            ("category", category),
+            ("language", language),
+            ("sentiment", sentiment),
+        ]:
+            if value is not None:
+                mask &= self.groups[key].to_numpy() == value
+        year = self.groups["year"].to_numpy()
+        if start_year is not None:
+            mask &= year >= start_year
+        if end_year is not None:
+            mask &= year <= end_year
+
+        entries = mask[self.group_ids]
+        totals = np.bincount(
+            self.term_ids[entries],
+            weights=self.counts[entries],
+            minlength=len(self.vocabulary),
+        )
+        top = np.argsort(totals)[::-1][:max_words]
+        top = top[totals[top] > 0]
+        return dict(zip(self.vocabulary[top].tolist(), totals[top].tolist()))
+
+
+def load_term_index(df):
+    """
+    Reads the persisted index, rebuilding it from df when it is missing
+    or older than the dataset file.
+    """
+    if (
+        term_index_path.exists()
+        and term_index_path.stat().st_mtime >= source_path().stat().st_mtime
+    ):
+        return TermIndex.load()
+
+    term_index = TermIndex.build(df)
+    try:
+        term_index.save()
+    except OSError:
+        pass
+    return term_index
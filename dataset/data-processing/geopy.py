@@ -1,83 +1,279 @@
+"""
+Geocoding of the event organizers and export of the map markers.
+
+Results are stored in a SQLite cache, including the addresses that could not
+be found, so a rerun only geocodes the organizers missing from it (e.g. the
+ones of newly added talks). Requests are sent concurrently within a rate budget,
+through a pluggable backend:
+
+    python geopy.py                                  # Nominatim, 1 request/s
+    python geopy.py --rate 5 --workers 8 --nominatim-domain localhost:8080 --nominatim-scheme http
+    python geopy.py --gazetteer cities.csv           # offline, no requests
+"""
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
 
-import json
 
-# Load the dataset
-df = pd.read_csv('FINAL_TEDX_DATASET_2024.csv')
+class GeocodingCache:
+    """
+    Persistent address -> (latitude, longitude) store, None for addresses
+    that were not found.
+    """
 
-# Extract unique addresses
-unique_addresses = df['event_organizer'].unique()
+    def __init__(self, path='geocoding_cache.sqlite'):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS locations '
+            '(address TEXT PRIMARY KEY, latitude REAL, longitude REAL)'
+        )
+        self.connection.commit()
 
-# Initialize geolocator and rate limiter
-geolocator = Nominatim(user_agent="ram")
-geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
+    def get_many(self, addresses):
+        known = {}
+        cursor = self.connection.execute(
+            'SELECT address, latitude, longitude FROM locations'
+        )
+        wanted = set(addresses)
+        for address, latitude, longitude in cursor:
+            if address in wanted:
+                known[address] = None if latitude is None else (latitude, longitude)
+        return known
 
-# Create dictionaries to store results
-location_dict = {}
-lat_dict = {}
-longi_dict = {}
+    def missing(self, addresses):
+        known = self.get_many(addresses)
+        return [address for address in addresses if address not in known]
 
-# Geocode unique addresses with error handling and checkpoints
-for i, addr in enumerate(tqdm(unique_addresses, desc="Geocoding addresses")):
-    try:
-        location = geocode(addr)
+    def put(self, address, location):
+        latitude, longitude = location if location else (None, None)
+        self.connection.execute(
+            'INSERT OR REPLACE INTO locations VALUES (?, ?, ?)',
+            (address, latitude, longitude),
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class RateLimiter:
+    """
+    Spaces the calls to wait() from all threads by at least 1 / rate seconds.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        time.sleep(start - now)
+
+
+# Backends are callables taking an address and returning (latitude, longitude),
+# or None when the address is not found. Exceptions mean the request failed,
+# such addresses are not cached and are retried on the next run.
+
+
+def nominatim_backend(user_agent='ram', domain=None, scheme=None, timeout=10):
+    # This script shares its name with the geopy package, make sure that the
+    # package is imported instead of the script directory
+    script_dir = Path(__file__).resolve().parent
+    sys.path[:] = [
+        path for path in sys.path if Path(path or '.').resolve() != script_dir
+    ]
+    from geopy.geocoders import Nominatim
+
+    options = {'user_agent': user_agent, 'timeout': timeout}
+    if domain:
+        options['domain'] = domain
+    if scheme:
+        options['scheme'] = scheme
+    geolocator = Nominatim(**options)
+
+    def geocode(address):
+        location = geolocator.geocode(address)
         if location:
-            lat_dict[addr] = location.latitude
-            longi_dict[addr] = location.longitude
-        else:
-            lat_dict[addr] = None
-            longi_dict[addr] = None
-    except Exception as e:
-        print(f"Error geocoding {addr}: {e}")
-        lat_dict[addr] = None
-        longi_dict[addr] = None
-
-    # Save checkpoints every 100 addresses
-    if (i + 1) % 100 == 0:
-        checkpoint_df = pd.DataFrame({
-            'address': list(lat_dict.keys()),
-            'latitude': list(lat_dict.values()),
-            'longitude': list(longi_dict.values())
-        })
-        checkpoint_df.to_csv('geocoding_checkpoint.csv', index=False)
-
-# Map results back to the original DataFrame
-df['latitude'] = df['event_organizer'].map(lat_dict)
-df['longitude'] = df['event_organizer'].map(longi_dict)
-
-# Save final results to CSV
-df.to_csv('geocoded_addresses.csv', index=False)
+            return location.latitude, location.longitude
+        return None
+
+    return geocode
+
+
+def gazetteer_backend(path):
+    """
+    Looks the addresses up in a local CSV with address, latitude and longitude columns.
+    """
+    gazetteer = pd.read_csv(path).drop_duplicates(subset='address')
+    locations = dict(
+        zip(gazetteer['address'], zip(gazetteer['latitude'], gazetteer['longitude']))
+    )
+    return locations.get
+
+
+def geocode_addresses(addresses, geocode, cache, rate=1.0, workers=4):
+    """
+    Geocodes the addresses missing from the cache and returns the locations
+    of all the addresses. rate is the number of requests per second, None for
+    local backends that do not need to be throttled.
+    """
+    missing = cache.missing(addresses)
+    limiter = RateLimiter(rate) if rate else None
+
+    def request(address):
+        if limiter:
+            limiter.wait()
+        return geocode(address)
+
+    def store(address, future):
+        progress.update()
+        try:
+            location = future.result()
+        except Exception as e:
+            print(f'Error geocoding {address}: {e}')
+            return
+        cache.put(address, location)
+
+    # At most two addresses per worker are queued ahead of the results, so an
+    # interrupted run stops after the requests in flight and the next run
+    # resumes from the cache
+    executor = ThreadPoolExecutor(max_workers=workers)
+    progress = tqdm(total=len(missing), desc='Geocoding addresses')
+    pending = deque()
+    try:
+        for address in missing:
+            pending.append((address, executor.submit(request, address)))
+            if len(pending) >= 2 * workers:
+                store(*pending.popleft())
+        while pending:
+            store(*pending.popleft())
+    finally:
+        executor.shutdown(cancel_futures=True)
+        progress.close()
+
+    return cache.get_many(addresses)
+
 
 # Extract cities from the dataset
 
+
 def get_cities(df):
     cities = df[['event_organizer', 'latitude', 'longitude']]
     cities = cities.drop_duplicates()
     cities = cities.dropna(subset=['latitude', 'longitude'])
     return cities
 
-cities = get_cities(df)
-
-# Convert DataFrame to GeoJSON
-geojson_data = {
-    "type": "FeatureCollection",
-    "features": [
-        {
-            "type": "Feature",
-            "geometry": {
-                "type": "Point",
-                "coordinates": [row['longitude'], row['latitude']]
-            },
-            "properties": {
-                "popup": f"<b>{row['event_organizer']}</b>"
-            }
-        } for _, row in cities.iterrows()
-    ]
-}
 
-# Optionally, save to a file for reuse
-with open("markers.geojson", "w") as f:
-    json.dump(geojson_data, f)
\ No newline at end of file
+def export_markers(cities, path='markers.geojson'):
+    """
+    Writes the cities as GeoJSON points, plus a binary companion the dashboard
+    memory-maps: float32 (latitude, longitude) pairs in .coords.npy, indices
+    into an interned popup table in .label_ids.npy and the table in .labels.json.
+    The table records the size and SHA-1 of the GeoJSON, the dashboard only
+    uses the companion when they match.
+    """
+    path = Path(path)
+    latitude = cities['latitude'].to_numpy(dtype='float64')
+    longitude = cities['longitude'].to_numpy(dtype='float64')
+    label_ids, popups = pd.factorize(
+        '<b>' + cities['event_organizer'].astype(str) + '</b>'
+    )
+    popups = popups.tolist()
+
+    # The GeoJSON text is assembled with array operations, the popups are
+    # only serialized once per unique label
+    popups_json = np.array([json.dumps(popup) for popup in popups], dtype=object)
+    features = (
+        '{"type": "Feature", "geometry": {"type": "Point", "coordinates": ['
+        + longitude.astype(str).astype(object)
+        + ', '
+        + latitude.astype(str).astype(object)
+        + ']}, "properties": {"popup": '
+        + popups_json[label_ids]
+        + '}}'
+    )
+    with open(path, 'w') as f:
+        f.write('{"type": "FeatureCollection", "features": [')
+        f.write(', '.join(features))
+        f.write(']}')
+
+    np.save(
+        path.with_suffix('.coords.npy'),
+        np.stack([latitude, longitude], axis=1).astype('float32'),
+    )
+    np.save(path.with_suffix('.label_ids.npy'), label_ids.astype('int32'))
+    content = path.read_bytes()
+    source = {'size': len(content), 'sha1': hashlib.sha1(content).hexdigest()}
+    with open(path.with_suffix('.labels.json'), 'w') as f:
+        json.dump({'source': source, 'labels': popups}, f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--dataset', default='FINAL_TEDX_DATASET_2024.csv')
+    parser.add_argument('--cache', default='geocoding_cache.sqlite')
+    parser.add_argument('--rate', type=float, default=1.0, help='requests per second')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument(
+        '--gazetteer',
+        help='offline CSV used instead of Nominatim, best with its own --cache',
+    )
+    parser.add_argument('--nominatim-domain')
+    parser.add_argument('--nominatim-scheme')
+    args = parser.parse_args()
+
+    # Load the dataset
+    df = pd.read_csv(args.dataset, low_memory=False)
+
+    # Extract unique addresses
+    unique_addresses = df['event_organizer'].dropna().unique().tolist()
+
+    rate = args.rate
+    if args.gazetteer:
+        geocode = gazetteer_backend(args.gazetteer)
+        # Local lookups are not throttled
+        rate = None
+    else:
+        geocode = nominatim_backend(
+            domain=args.nominatim_domain, scheme=args.nominatim_scheme
+        )
+
+    cache = GeocodingCache(args.cache)
+    try:
+        locations = geocode_addresses(
+            unique_addresses, geocode, cache, rate=rate, workers=args.workers
+        )
+    finally:
+        cache.close()
+
+    # Map results back to the original DataFrame
+    found = {address: location for address, location in locations.items() if location}
+    lat_dict = {address: location[0] for address, location in found.items()}
+    longi_dict = {address: location[1] for address, location in found.items()}
+    df['latitude'] = df['event_organizer'].map(lat_dict)
+    df['longitude'] = df['event_organizer'].map(longi_dict)
+
+    # Save final results to CSV
+    df.to_csv('geocoded_addresses.csv', index=False)
+
+    export_markers(get_cities(df))
+
+
+if __name__ == '__main__':
+    main()
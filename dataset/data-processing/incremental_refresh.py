@@ -0,0 +1,188 @@
+"""
+Incremental refresh of the dataset from a fresh scrape.
+
+Talks are identified by a hash of their normalized full title (talk title,
+speaker and event), so a fresh scrape can be diffed against the existing
+dataset. The view counts of the known talks are updated in place and only the
+new talks go through the processing stages:
+
+    python incremental_refresh.py refresh video_titles_TEDx.jsonl \\
+        --scrape-date 2025-01-01 --stage my_models:categorize
+    python incremental_refresh.py merge pending_talks.csv
+
+Stages are callables taking and returning the DataFrame of new talks, extra ones
+(e.g. the translation, categorization and sentiment models) are given as
+module:function. New talks missing any column of the dataset after the stages
+are written to the pending file, to be completed and merged later.
+"""
+
+import argparse
+import hashlib
+import importlib
+import re
+import unicodedata
+from datetime import datetime
+
+import pandas as pd
+
+import text_parsing
+
+DATASET_PATH = 'FINAL_TEDX_DATASET_2024.csv'
+PENDING_PATH = 'pending_talks.csv'
+
+
+def normalize_title(full_title):
+    full_title = unicodedata.normalize('NFKC', str(full_title)).casefold()
+    return re.sub(r'\s+', ' ', full_title).strip()
+
+
+def talk_ids(full_titles):
+    """
+    Returns the stable id of each talk. Talks sharing a full title are told
+    apart by their rank counted from the oldest one, as the channel lists the
+    newest talks first and a new upload does not change the rank of older ones.
+    """
+    full_titles = pd.Series(full_titles)
+    keys = full_titles.map(normalize_title)
+    rank = keys.iloc[::-1].groupby(keys.iloc[::-1]).cumcount().iloc[::-1]
+    keys = keys.where(rank == 0, keys + '#' + rank.astype(str))
+    return keys.map(
+        lambda key: hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+    )
+
+
+def parse_scrape(strings, scrape_date):
+    strings = list(strings)
+    talks = text_parsing.parse(strings, scrape_date)
+    talks = talks.rename(columns={'title': 'full_title'})
+    talks.insert(0, 'original_string', [strings[i] for i in talks.index])
+    return talks.reset_index(drop=True)
+
+
+def diff(dataset, scraped):
+    """
+    Updates the views of the dataset talks found in the scrape and returns
+    the scraped talks missing from the dataset, with their talk_id.
+    """
+    dataset_ids = talk_ids(dataset['full_title'])
+    scraped_ids = talk_ids(scraped['full_title'])
+
+    views = pd.Series(scraped['views'].to_numpy(), index=scraped_ids)
+    views = views[views.notna()]
+    known = dataset_ids.isin(views.index)
+    dataset.loc[known, 'views'] = views.loc[dataset_ids[known]].to_numpy()
+    print(f'Updated the views of {known.sum()} talks')
+
+    new_talks = scraped.assign(talk_id=scraped_ids)[~scraped_ids.isin(dataset_ids)]
+    print(f'Found {len(new_talks)} new talks')
+    return new_talks.reset_index(drop=True)
+
+
+# Stages
+
+
+def split_full_title(talks):
+    """
+    Splits the 'title | speaker | event' full titles, the title may contain '|'.
+    """
+    parts = talks['full_title'].str.rsplit('|', n=2, expand=True)
+    parts = parts.reindex(columns=range(3))
+    parts = parts.apply(lambda column: column.str.strip())
+    has_all = parts[2].notna()
+    talks['title'] = parts[0].where(has_all, talks['full_title'])
+    talks['speaker'] = parts[1].where(has_all)
+    talks['event'] = parts[2].where(has_all)
+    talks['event_organizer'] = talks['event'].str.extract(r'TEDx(.*)', expand=False)
+    return talks
+
+
+def detect_language(talks):
+    from language_detection import detect_languages
+
+    detected = detect_languages(talks['title'])
+    talks['language'] = detected['language']
+    talks['language_confidence'] = detected['language_confidence']
+    return talks
+
+
+default_stages = [split_full_title, detect_language]
+
+
+def load_stage(name):
+    module_name, function_name = name.split(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def run_stages(talks, stages):
+    for stage in stages:
+        print(f'Running {stage.__name__} on {len(talks)} talks')
+        talks = stage(talks)
+    return talks
+
+
+def merge(dataset, talks):
+    """
+    Returns the dataset with the new talks on top, as the newest talks are
+    listed first. Talks already in the dataset are skipped, e.g. when the
+    pending file is merged twice.
+    """
+    known = talks['talk_id'].isin(talk_ids(dataset['full_title']))
+    talks = talks[~known]
+    print(f'Merging {len(talks)} new talks')
+    return pd.concat([talks[dataset.columns], dataset], ignore_index=True)
+
+
+def refresh(
+    dataset_path, strings, scrape_date, stages=default_stages, pending_path=PENDING_PATH
+):
+    dataset = pd.read_csv(dataset_path, low_memory=False)
+    new_talks = diff(dataset, parse_scrape(strings, scrape_date))
+    if len(new_talks):
+        new_talks = run_stages(new_talks, stages)
+        missing = [column for column in dataset.columns if column not in new_talks]
+        if missing:
+            new_talks.to_csv(pending_path, index=False)
+            missing = ', '.join(missing)
+            print(f'Wrote the new talks to {pending_path}, missing {missing}')
+        else:
+            dataset = merge(dataset, new_talks)
+    dataset.to_csv(dataset_path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--dataset', default=DATASET_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    refresh_parser = commands.add_parser('refresh', help='diff a fresh scrape')
+    refresh_parser.add_argument('scrape', help='JSONL or JSON file of the scraper')
+    refresh_parser.add_argument(
+        '--scrape-date', type=datetime.fromisoformat, default=datetime.now()
+    )
+    refresh_parser.add_argument(
+        '--stage',
+        action='append',
+        default=[],
+        help='extra stage as module:function, run after the default ones',
+    )
+    refresh_parser.add_argument('--pending', default=PENDING_PATH)
+
+    merge_parser = commands.add_parser('merge', help='merge completed new talks')
+    merge_parser.add_argument('pending')
+    args = parser.parse_args()
+
+    if args.command == 'refresh':
+        stages = default_stages + [load_stage(name) for name in args.stage]
+        strings = text_parsing.read_strings(args.scrape)
+        refresh(args.dataset, strings, args.scrape_date, stages, args.pending)
+    else:
+        dataset = pd.read_csv(args.dataset, low_memory=False)
+        talks = pd.read_csv(args.pending, low_memory=False)
+        missing = [column for column in dataset.columns if column not in talks]
+        if missing:
+            parser.error(f'{args.pending} is missing {", ".join(missing)}')
+        merge(dataset, talks).to_csv(args.dataset, index=False)
+
+
+if __name__ == '__main__':
+    main()
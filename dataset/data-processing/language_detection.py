@@ -0,0 +1,202 @@
+"""
+Language detection of the titles with a confidence score.
+
+Titles in a script used by a single language, and ASCII titles made of common
+English words, are labelled without the statistical detector. The other titles
+go to langdetect with a fixed seed, in a pool of processes:
+
+    python language_detection.py tedx_videos_extended.csv \\
+        tedx_videos_extended_with_lang.csv --workers 8
+
+Adds the language, language_confidence and language_method columns, the
+method being 'script', 'english' or 'langdetect', or 'none' for the titles
+without letters, whose language is 'unknown'. Repeated titles are detected
+once.
+"""
+
+import argparse
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Scripts written by one language among the ones of the dataset. Han
+# characters count as Japanese next to kana and as Chinese without them
+script_languages = {
+    'ja': r'\u3040-\u30ff\u4e00-\u9fff',
+    'zh': r'\u4e00-\u9fff',
+    'ko': r'\u1100-\u11ff\u3130-\u318f\uac00-\ud7af',
+    'el': r'\u0370-\u03ff',
+    'he': r'\u0590-\u05ff',
+    'hy': r'\u0530-\u058f',
+    'ka': r'\u10a0-\u10ff',
+    'bn': r'\u0980-\u09ff',
+    'pa': r'\u0a00-\u0a7f',
+    'gu': r'\u0a80-\u0aff',
+    'ta': r'\u0b80-\u0bff',
+    'te': r'\u0c00-\u0c7f',
+    'kn': r'\u0c80-\u0cff',
+    'ml': r'\u0d00-\u0d7f',
+    'si': r'\u0d80-\u0dff',
+    'th': r'\u0e00-\u0e7f',
+    'my': r'\u1000-\u109f',
+    'km': r'\u1780-\u17ff',
+}
+script_patterns = {
+    language: re.compile(f'[{ranges}]') for language, ranges in script_languages.items()
+}
+kana_pattern = re.compile(r'[\u3040-\u30ff]')
+letter_pattern = re.compile(r'[^\W\d_]')
+word_pattern = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+# Function words that are not also common words of the other Latin script
+# languages, e.g. 'a', 'in', 'is', 'me', 'was' or 'will' are left out
+english_words = frozenset(
+    'the and of for you your how what why when where who which our with this '
+    'that from about can are be it its not they them their we\'re you\'re '
+    'don\'t it\'s i\'m would should could have were been into than then '
+    'more most just only through every make need'.split()
+)
+
+
+def script_language(text):
+    """
+    Returns the language of the script of most letters of a non-ASCII text
+    and their share of the letters, or None when no such script dominates.
+    """
+    letters = letter_pattern.findall(text)
+    if not letters:
+        return None
+    letters = ''.join(letters)
+    for language, pattern in script_patterns.items():
+        if language == 'ja' and not kana_pattern.search(letters):
+            continue
+        share = len(pattern.findall(letters)) / len(letters)
+        if share >= 0.5:
+            return language, share
+    return None
+
+
+def english_language(text, min_share=0.2):
+    """
+    Returns 'en' and the share of English function words of an ASCII text
+    when it reaches min_share, None otherwise.
+    """
+    words = word_pattern.findall(text.lower())
+    if len(words) < 2:
+        return None
+    share = sum(word in english_words for word in words) / len(words)
+    if share < min_share:
+        return None
+    return 'en', share
+
+
+def init_detector(seed=0):
+    from langdetect import DetectorFactory
+
+    DetectorFactory.seed = seed
+
+
+def detect_statistical(texts, seed=0):
+    """
+    Returns the most probable language of each text with langdetect and its
+    probability, ('unknown', 0.0) when langdetect finds no features.
+    """
+    from langdetect import LangDetectException, detect_langs
+
+    init_detector(seed)
+    results = []
+    for text in texts:
+        try:
+            best = detect_langs(text)[0]
+            results.append((best.lang, best.prob))
+        except LangDetectException:
+            results.append(('unknown', 0.0))
+    return results
+
+
+def detect_one(text):
+    """
+    Returns the language, confidence and method of a text, or None when it
+    needs the statistical detector.
+    """
+    if not letter_pattern.search(text):
+        return 'unknown', 0.0, 'none'
+    if text.isascii():
+        result = english_language(text)
+        method = 'english'
+    else:
+        result = script_language(text)
+        method = 'script'
+    return None if result is None else (*result, method)
+
+
+def detect_languages(texts, workers=None, chunk_size=2000, seed=0):
+    """
+    Returns a DataFrame indexed like texts with the language, confidence and
+    method of each text. The titles left to langdetect are split in chunks
+    over workers processes, the results do not depend on the number of
+    workers.
+    """
+    texts = pd.Series(texts)
+    codes, uniques = pd.factorize(texts.fillna('').astype(str))
+
+    languages = np.empty(len(uniques), dtype=object)
+    confidences = np.zeros(len(uniques), dtype='float32')
+    methods = np.empty(len(uniques), dtype=object)
+    ambiguous = []
+    for i, text in enumerate(uniques):
+        result = detect_one(text)
+        if result is None:
+            ambiguous.append(i)
+        else:
+            languages[i], confidences[i], methods[i] = result
+
+    chunks = [
+        [uniques[i] for i in ambiguous[start : start + chunk_size]]
+        for start in range(0, len(ambiguous), chunk_size)
+    ]
+    if workers and workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_detector, initargs=(seed,)
+        ) as executor:
+            results = executor.map(detect_statistical, chunks, [seed] * len(chunks))
+            results = [result for chunk in results for result in chunk]
+    else:
+        results = [result for chunk in chunks for result in detect_statistical(chunk)]
+
+    for i, (language, confidence) in zip(ambiguous, results):
+        languages[i], confidences[i], methods[i] = language, confidence, 'langdetect'
+
+    return pd.DataFrame(
+        {
+            'language': languages[codes],
+            'language_confidence': confidences[codes],
+            'language_method': methods[codes],
+        },
+        index=texts.index,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('input', help='CSV with the titles')
+    parser.add_argument('output')
+    parser.add_argument('--column', default='title')
+    parser.add_argument('--workers', type=int, help='number of processes')
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input, low_memory=False)
+    detected = detect_languages(
+        df[args.column], args.workers, args.chunk_size, args.seed
+    )
+    df[detected.columns] = detected
+    df.to_csv(args.output, index=False)
+    print(detected['language_method'].value_counts().to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""
+Parsing of the scraped video strings into title, views and upload date.
+
+The strings are parsed in chunks with pandas string methods, optionally in a
+pool of processes, and can be streamed from an iterator in constant memory:
+
+    python text_parsing.py video_titles_TEDx.jsonl tedx_videos.csv \\
+        --scrape-date 2024-12-25 --workers 4
+"""
+
+import argparse
+import json
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+# Polish and English pages, with and without the view count. The title ends at
+# the first marker followed by the rest of its locale's format
+string_pattern = re.compile(
+    r'^(?P<title>.*?)'
+    r'(?: Autor: TEDx Talks (?P<pl_views>[\d\xa0 ,]*) wyświetle(?:ń|nia)'
+    r'| by TEDx Talks(?: (?P<en_views>[\d\xa0 ,]*) views)?)'
+    r' (?P<date_str>.*)$',
+    re.DOTALL,
+)
+
+units_pl = {
+    'rok': 'years', 'lata': 'years', 'lat': 'years',
+    'miesiąc': 'months', 'miesiące': 'months', 'miesięcy': 'months',
+    'tydzień': 'weeks', 'tygodnie': 'weeks', 'tygodni': 'weeks',
+    'dzień': 'days', 'dni': 'days',
+    'godzina': 'hours', 'godziny': 'hours', 'godzin': 'hours',
+    'minut': 'minutes', 'minuta': 'minutes', 'minuty': 'minutes',
+    'sekund': 'seconds', 'sekundy': 'seconds', 'sekunda': 'seconds',
+}
+units_en = {
+    'year': 'years', 'years': 'years',
+    'month': 'months', 'months': 'months',
+    'week': 'weeks', 'weeks': 'weeks',
+    'day': 'days', 'days': 'days',
+    'hour': 'hours', 'hours': 'hours',
+    'minute': 'minutes', 'minutes': 'minutes',
+    'second': 'seconds', 'seconds': 'seconds',
+}
+units = {**units_pl, **units_en}
+
+
+def unit_alternatives(names):
+    # Longest first, so that e.g. 'minuta' is not cut to 'minut'
+    return '|'.join(sorted(names, key=len, reverse=True))
+
+
+date_pattern = re.compile(
+    rf'(?P<pl_value>\d+)\s+(?P<pl_unit>{unit_alternatives(units_pl)})\s+temu'
+    rf'|(?P<en_value>\d+)\s+(?P<en_unit>{unit_alternatives(units_en)})\s+ago'
+)
+
+default_scrape_date = datetime(2024, 12, 25)
+
+
+def parse_strings(strings):
+    """
+    Splits the scraped strings into title, views and date_str columns.
+    The strings that do not match any pattern are dropped.
+    """
+    strings = pd.Series(strings, dtype=object)
+    parts = strings.str.replace('\n', ' ', regex=False).str.extract(string_pattern)
+
+    matched = parts['title'].notna()
+    if not matched.all():
+        print(f'Could not parse {(~matched).sum()} strings')
+    parts = parts[matched]
+
+    # A chunk without any view count has all-NaN float columns here
+    views = parts['pl_views'].astype('string').fillna(
+        parts['en_views'].astype('string')
+    )
+    views = views.str.replace(r'[\xa0 ,]', '', regex=True)
+    return pd.DataFrame(
+        {
+            'title': parts['title'],
+            'views': pd.to_numeric(views, errors='coerce').astype('float64'),
+            'date_str': parts['date_str'],
+        }
+    )
+
+
+def parse_relative_dates(date_strs, scrape_date=default_scrape_date):
+    """
+    Converts strings such as '2 dni temu 13 minut' or '15 years ago 24 minutes'
+    to the dates relative to scrape_date. Polish amounts take precedence over
+    English ones, strings without any are set to scrape_date.
+    """
+    date_strs = pd.Series(date_strs, dtype=object)
+    # Many strings are repeated, only the distinct ones are parsed
+    codes, unique_strs = pd.factorize(date_strs)
+    unique_dates = parse_unique_dates(pd.Series(unique_strs, dtype=object), scrape_date)
+    dates = pd.Series(
+        unique_dates.to_numpy()[codes], index=date_strs.index, dtype='datetime64[ns]'
+    )
+    dates[codes < 0] = pd.NaT
+
+    unparsed = dates.isna()
+    if unparsed.any():
+        print(f'Could not parse the date of {unparsed.sum()} strings')
+    return dates.fillna(pd.Timestamp(scrape_date))
+
+
+def parse_unique_dates(date_strs, scrape_date):
+    """
+    Returns the dates of distinct strings, NaT for the ones without any amount.
+    """
+    matches = date_strs.str.extractall(date_pattern)
+    rows = matches.index.get_level_values(0)
+
+    is_pl = matches['pl_value'].notna().to_numpy()
+    has_pl = pd.Series(is_pl, index=rows).groupby(level=0).any()
+    keep = is_pl | ~has_pl.reindex(rows).to_numpy()
+    matches = matches[keep]
+
+    unit = matches['pl_unit'].fillna(matches['en_unit']).map(units)
+    value = matches['pl_value'].fillna(matches['en_value']).astype(int)
+    amounts = pd.DataFrame(
+        {
+            'row': matches.index.get_level_values(0),
+            'unit': unit.to_numpy(),
+            'value': -value.to_numpy(),
+        }
+    )
+    # A repeated unit overrides the earlier one
+    amounts = amounts.drop_duplicates(subset=['row', 'unit'], keep='last')
+    amounts = amounts.pivot(index='row', columns='unit', values='value')
+    amounts = amounts.fillna(0).astype(int)
+
+    # Most strings share a handful of offsets, each date is computed once
+    columns = amounts.columns
+    offset_dates = {
+        offset: scrape_date + relativedelta(**dict(zip(columns, offset)))
+        for offset in amounts.drop_duplicates().itertuples(index=False, name=None)
+    }
+    row_dates = pd.Series(
+        [offset_dates[offset] for offset in amounts.itertuples(index=False, name=None)],
+        index=amounts.index,
+        dtype='datetime64[ns]',
+    )
+    return row_dates.reindex(date_strs.index)
+
+
+def parse_chunk(strings, scrape_date=default_scrape_date):
+    videos = parse_strings(strings)
+    videos['date'] = parse_relative_dates(videos['date_str'], scrape_date)
+    videos['year'] = videos['date'].dt.year
+    return videos
+
+
+def chunked(strings, chunk_size):
+    iterator = iter(strings)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_parsed(
+    strings, scrape_date=default_scrape_date, chunk_size=50000, workers=None
+):
+    """
+    Yields the parsed strings as DataFrames of up to chunk_size rows, indexed
+    by the position of the strings in the input. strings can be any iterable,
+    only a few chunks are held in memory at a time.
+    """
+    offset = 0
+    if not workers:
+        for chunk in chunked(strings, chunk_size):
+            videos = parse_chunk(chunk, scrape_date)
+            videos.index += offset
+            offset += len(chunk)
+            yield videos
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # At most two chunks per worker are submitted ahead of the results
+        pending = deque()
+        for chunk in chunked(strings, chunk_size):
+            future = executor.submit(parse_chunk, chunk, scrape_date)
+            pending.append((future, len(chunk)))
+            if len(pending) < 2 * workers:
+                continue
+            future, size = pending.popleft()
+            videos = future.result()
+            videos.index += offset
+            offset += size
+            yield videos
+        while pending:
+            future, size = pending.popleft()
+            videos = future.result()
+            videos.index += offset
+            offset += size
+            yield videos
+
+
+def parse(strings, scrape_date=default_scrape_date, chunk_size=50000, workers=None):
+    """
+    Parses the strings into a DataFrame of title, views, date_str, date and year.
+    """
+    chunks = list(iter_parsed(strings, scrape_date, chunk_size, workers))
+    return pd.concat(chunks) if chunks else parse_chunk([], scrape_date)
+
+
+def read_strings(path):
+    """
+    Streams the strings of a JSONL file, or reads the JSON list written by
+    older versions of the scraper.
+    """
+    if path.endswith('.jsonl'):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+    else:
+        with open(path, encoding='utf-8') as f:
+            yield from json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('input', nargs='?', default='video_titles_TEDx.jsonl')
+    parser.add_argument('output', nargs='?', default='tedx_videos.csv')
+    parser.add_argument(
+        '--scrape-date',
+        type=datetime.fromisoformat,
+        default=default_scrape_date,
+        help='date the strings were scraped on, YYYY-MM-DD',
+    )
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--workers', type=int, help='number of processes')
+    args = parser.parse_args()
+
+    chunks = iter_parsed(
+        read_strings(args.input), args.scrape_date, args.chunk_size, args.workers
+    )
+    for i, videos in enumerate(chunks):
+        videos.to_csv(
+            args.output, mode='a' if i else 'w', header=not i, index=False
+        )
+
+
+if __name__ == '__main__':
+    main()
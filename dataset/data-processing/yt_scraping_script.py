@@ -1,13 +1,19 @@
-import requests
-from lxml import html
+import argparse
 import json
-import time
+import os
 import random
+import time
+
+import requests
+from lxml import html
 
 CHANNEL_HANDLE = '@TEDx'
 BASE_URL = f'https://www.youtube.com/{CHANNEL_HANDLE}/videos'
 API_URL = 'https://www.youtube.com/youtubei/v1/browse'
 HEADERS = {'Content-Type': 'application/json'}
+OUTPUT_PATH = 'video_titles_TEDx.jsonl'
+STATE_PATH = 'yt_scraping_state.json'
+EXPORT_PATH = 'video_titles_TEDx.json'
 CLIENT_CONTEXT = {
     'context': {
         'client': {
@@ -17,15 +23,15 @@ CLIENT_CONTEXT = {
     }
 }
 
-def fetch_page(url):
-    response = requests.get(url)
+def fetch_page(session, url):
+    response = session.get(url)
     response.raise_for_status()
     return response.text
 
-def fetch_page_with_retry(url, retries=5, delay=5):
+def fetch_page_with_retry(session, url, retries=5, delay=5):
     for i in range(retries):
         try:
-            return fetch_page(url)
+            return fetch_page(session, url)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching page: {e}. Retrying in {delay} seconds...")
             time.sleep(delay)
@@ -54,17 +60,17 @@ def get_continuation_token(contents):
         return None
     return last_content['continuationItemRenderer']['continuationEndpoint']['continuationCommand']['token']
 
-def fetch_continuation_data(token):
+def fetch_continuation_data(session, api_url, token):
     request_data = CLIENT_CONTEXT.copy()
     request_data['continuation'] = token
-    response = requests.post(API_URL, headers=HEADERS, json=request_data)
+    response = session.post(api_url, headers=HEADERS, json=request_data)
     response.raise_for_status()
     return response.json()
 
-def fetch_continuation_data_with_retry(token, retries=5, delay=5):
+def fetch_continuation_data_with_retry(session, api_url, token, retries=5, delay=5):
     for i in range(retries):
         try:
-            return fetch_continuation_data(token)
+            return fetch_continuation_data(session, api_url, token)
         except requests.exceptions.RequestException as e:
             print(f"Error fetching continuation data: {e}. Retrying in {delay} seconds...")
             time.sleep(delay)
@@ -75,46 +81,119 @@ def random_sleep(min_delay=1, max_delay=3):
     # print(f"Sleeping for {delay:.2f} seconds")
     time.sleep(delay)
 
+# Progress is checkpointed after every page: the titles are appended to a JSONL
+# file, then the state file records the next continuation token along with the
+# size of the JSONL file at that point. A resumed run truncates the titles
+# written after the last checkpoint, so no page is lost or duplicated.
+
+def load_state(state_path):
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path) as file:
+        return json.load(file)
+
+def save_state(state_path, state):
+    partial_path = state_path + '.tmp'
+    with open(partial_path, 'w') as file:
+        json.dump(state, file)
+    os.replace(partial_path, state_path)
+
+def write_page(file, titles):
+    for title in titles:
+        file.write(json.dumps(title, ensure_ascii=False) + '\n')
+    file.flush()
+    os.fsync(file.fileno())
+
+def export_titles(output_path, export_path):
+    """
+    Writes the titles of the JSONL file as the JSON list read by the notebooks,
+    one title at a time.
+    """
+    with open(output_path, encoding='utf-8') as source, open(export_path, 'w', encoding='utf-8') as file:
+        file.write('[')
+        for i, line in enumerate(source):
+            file.write(',\n    ' if i else '\n    ')
+            file.write(line.rstrip('\n'))
+        file.write('\n]')
+
 def main():
+    parser = argparse.ArgumentParser(description='Scrapes the video titles of a YouTube channel.')
+    parser.add_argument('--base-url', default=BASE_URL)
+    parser.add_argument('--api-url', default=API_URL)
+    parser.add_argument('--output', default=OUTPUT_PATH)
+    parser.add_argument('--state', default=STATE_PATH)
+    parser.add_argument('--export', default=EXPORT_PATH)
+    parser.add_argument('--min-delay', type=float, default=1)
+    parser.add_argument('--max-delay', type=float, default=3)
+    args = parser.parse_args()
+
     start_time = time.time()
-    titles = []
-    
-    try:
-        text = fetch_page_with_retry(BASE_URL)
-        yt_data = parse_initial_data(text)
-        if not yt_data:
-            print("Failed to retrieve initial data")
-            return
-
-        contents = yt_data['contents']['twoColumnBrowseResultsRenderer']['tabs'][1]['tabRenderer']['content']['richGridRenderer']['contents']
-        
-        extract_video_titles(contents, titles)
-        continuation_token = get_continuation_token(contents)
-
-        while continuation_token:
-            data = fetch_continuation_data_with_retry(continuation_token)
-            if 'onResponseReceivedActions' not in data:
-                print('Retrying')
-                continue
-            continuation_items = data['onResponseReceivedActions'][0]['appendContinuationItemsAction']['continuationItems']
-            extract_video_titles(continuation_items, titles)
-            continuation_token = get_continuation_token(continuation_items)
-            
-            if len(titles) % 5000 == 0:
-                print(f"Progress: {len(titles)} video titles extracted")
-            
-            random_sleep()
-
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-    finally:
-        with open('video_titles_TEDx.json', 'w') as file:
-            json.dump(titles, file, ensure_ascii=False, indent=4)
-        
-        end_time = time.time()
-        print(f"Processing time: {end_time - start_time} seconds")
-        print(f"Total video titles extracted: {len(titles)}")
+    state = load_state(args.state)
+    # One session for all the requests, the connection is kept alive
+    session = requests.Session()
+
+    with open(args.output, 'a+', encoding='utf-8') as file:
+        if state:
+            file.truncate(state['offset'])
+            print(f"Resuming after {state['count']} video titles")
+        else:
+            file.truncate(0)
+            state = {'token': None, 'offset': 0, 'count': 0, 'done': False}
+
+        def checkpoint(titles, token):
+            write_page(file, titles)
+            state.update(
+                token=token,
+                offset=file.tell(),
+                count=state['count'] + len(titles),
+                done=token is None,
+            )
+            save_state(args.state, state)
+
+        try:
+            if state['count'] == 0 and not state['done']:
+                text = fetch_page_with_retry(session, args.base_url)
+                yt_data = parse_initial_data(text)
+                if not yt_data:
+                    print("Failed to retrieve initial data")
+                    return
+
+                contents = yt_data['contents']['twoColumnBrowseResultsRenderer']['tabs'][1]['tabRenderer']['content']['richGridRenderer']['contents']
+
+                titles = []
+                extract_video_titles(contents, titles)
+                checkpoint(titles, get_continuation_token(contents))
+
+            while state['token']:
+                data = fetch_continuation_data_with_retry(session, args.api_url, state['token'])
+                if 'onResponseReceivedActions' not in data:
+                    print('Retrying')
+                    random_sleep(args.min_delay, args.max_delay)
+                    continue
+                continuation_items = data['onResponseReceivedActions'][0]['appendContinuationItemsAction']['continuationItems']
+                titles = []
+                extract_video_titles(continuation_items, titles)
+                previous_count = state['count']
+                checkpoint(titles, get_continuation_token(continuation_items))
+
+                if state['count'] // 5000 > previous_count // 5000:
+                    print(f"Progress: {state['count']} video titles extracted")
+
+                random_sleep(args.min_delay, args.max_delay)
+
+        except Exception as e:
+            print(f"An error occurred: {e}")
+
+        finally:
+            session.close()
+            end_time = time.time()
+            print(f"Processing time: {end_time - start_time} seconds")
+            print(f"Total video titles extracted: {state['count']}")
+
+    if state['done']:
+        export_titles(args.output, args.export)
+    else:
+        print(f"Run the script again to resume from {args.state}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
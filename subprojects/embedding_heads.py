@@ -0,0 +1,350 @@
+"""
+Topic and sentiment heads over cached sentence embeddings of the titles.
+
+The titles are embedded once into a float16 .npy matrix. Small linear or MLP
+heads are trained on it to reproduce the probabilities of the fine-tuned
+models, so new labels and threshold experiments only take matrix multiplies:
+
+    python embedding_heads.py embed FINAL_TEDX_DATASET_2024.csv embeddings.npy
+    python embedding_heads.py train-topics embeddings.npy topics.npy topics_head.npz
+    python embedding_heads.py train-sentiment embeddings.npy sentiment/ \\
+        sentiment_head.npz --hidden 256
+    python embedding_heads.py predict embeddings.npy topics_head.npz head_topics.npy
+
+topics.npy and sentiment/ are the outputs of topic_inference.py and
+sentiment_inference.py on the same CSV. The predictions are written like the
+matrix of topic_inference.py, its tune and assign commands read them too.
+Embedding rerun on the same output resumes an interrupted run.
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import sentiment_inference
+from inference import (
+    BatchedClassifier,
+    PartStore,
+    progress_path,
+    score_matrix,
+    sigmoid,
+    softmax,
+    write_progress,
+)
+from topic_inference import load_topics
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class SentenceEncoder(BatchedClassifier):
+    """
+    Mean pooled and normalized last hidden states of a transformers model.
+    """
+
+    return_tensors = "pt"
+
+    def __init__(
+        self,
+        model_name=EMBEDDING_MODEL,
+        device=None,
+        num_threads=None,
+        batch_size=128,
+        max_length=128,
+    ):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.torch = torch
+        self.model_name = model_name
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        if self.device == "cpu" and num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.model = AutoModel.from_pretrained(model_name)
+        self.model.to(self.device).eval()
+        super().__init__(
+            AutoTokenizer.from_pretrained(model_name),
+            self.model.config,
+            batch_size,
+            max_length,
+        )
+
+    def forward(self, features):
+        features = features.to(self.device)
+        with self.torch.inference_mode():
+            hidden = self.model(**features).last_hidden_state
+            mask = features["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            pooled = self.torch.nn.functional.normalize(pooled, dim=1)
+        return pooled.float().cpu().numpy()
+
+    def embed(self, texts):
+        return self.run(texts, self.config.hidden_size)
+
+
+def embed_titles(encoder, texts, path, chunk_size=10000):
+    return score_matrix(
+        texts,
+        path,
+        encoder.config.hidden_size,
+        encoder.embed,
+        {"model": encoder.model_name},
+        chunk_size,
+        desc="Embedding titles",
+    )
+
+
+class Head:
+    """
+    Linear head, or MLP with ReLU hidden layers, giving the softmax or sigmoid
+    probabilities of the labels.
+    """
+
+    def __init__(self, layers, activation, labels):
+        self.layers = layers
+        self.activation = activation
+        self.labels = list(labels)
+
+    def logits(self, embeddings):
+        x = np.asarray(embeddings, dtype="float32")
+        for i, (weight, bias) in enumerate(self.layers):
+            x = x @ weight + bias
+            if i < len(self.layers) - 1:
+                x = np.maximum(x, 0)
+        return x
+
+    def probabilities(self, embeddings):
+        logits = self.logits(embeddings)
+        return softmax(logits) if self.activation == "softmax" else sigmoid(logits)
+
+    def save(self, path):
+        arrays = {}
+        for i, (weight, bias) in enumerate(self.layers):
+            arrays[f"weight_{i}"], arrays[f"bias_{i}"] = weight, bias
+        meta = {"activation": self.activation, "labels": self.labels}
+        np.savez(path, meta=json.dumps(meta), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        arrays = np.load(path)
+        meta = json.loads(str(arrays["meta"]))
+        layers = [
+            (arrays[f"weight_{i}"], arrays[f"bias_{i}"])
+            for i in range(sum(name.startswith("weight_") for name in arrays.files))
+        ]
+        return cls(layers, meta["activation"], meta["labels"])
+
+
+def agreement(head, probabilities, targets):
+    """
+    Share of the teacher's softmax predictions, or micro F1 of its sigmoid
+    labels at 0.5, reproduced by the head.
+    """
+    if head.activation == "softmax":
+        return (probabilities.argmax(axis=1) == targets.argmax(axis=1)).mean()
+    predicted, actual = probabilities >= 0.5, targets >= 0.5
+    return 2 * (predicted & actual).sum() / max(predicted.sum() + actual.sum(), 1)
+
+
+def train_head(
+    embeddings,
+    targets,
+    labels,
+    activation,
+    hidden=0,
+    epochs=20,
+    batch_size=256,
+    learning_rate=1e-3,
+    weight_decay=1e-4,
+    validation=0.1,
+    seed=0,
+):
+    """
+    Trains a head on the teacher probabilities with Adam, the cross-entropy
+    with soft targets for softmax heads and the binary one for sigmoid heads.
+    Rows without embedding or targets are skipped, the agreement with the
+    teacher on the held out rows is printed after every epoch.
+    """
+    rng = np.random.default_rng(seed)
+    targets = np.asarray(targets, dtype="float32")
+    rows = np.flatnonzero(~np.isnan(targets).any(axis=1))
+    present = np.ones(len(rows), dtype=bool)
+    for start in range(0, len(rows), 50000):
+        chunk = np.asarray(embeddings[rows[start : start + 50000]])
+        present[start : start + 50000] = ~np.isnan(chunk).any(axis=1)
+    rows = rng.permutation(rows[present])
+    n_validation = int(len(rows) * validation)
+    validation_rows, train_rows = rows[:n_validation], rows[n_validation:]
+
+    sizes = [embeddings.shape[1]] + ([hidden] if hidden else []) + [len(labels)]
+    layers = [
+        (
+            rng.normal(0, np.sqrt(2 / n_in), (n_in, n_out)).astype("float32"),
+            np.zeros(n_out, dtype="float32"),
+        )
+        for n_in, n_out in zip(sizes[:-1], sizes[1:])
+    ]
+    head = Head(layers, activation, labels)
+    parameters = [array for layer in layers for array in layer]
+    moments = [np.zeros_like(array) for array in parameters]
+    velocities = [np.zeros_like(array) for array in parameters]
+    beta1, beta2, step = 0.9, 0.999, 0
+
+    for epoch in range(epochs):
+        train_rows = rng.permutation(train_rows)
+        for start in range(0, len(train_rows), batch_size):
+            # Sorted rows read the memory-mapped embeddings in order
+            batch = np.sort(train_rows[start : start + batch_size])
+            x = np.asarray(embeddings[batch], dtype="float32")
+
+            inputs = []
+            for i, (weight, bias) in enumerate(layers):
+                inputs.append(x)
+                x = x @ weight + bias
+                if i < len(layers) - 1:
+                    x = np.maximum(x, 0)
+            probabilities = softmax(x) if activation == "softmax" else sigmoid(x)
+
+            # Both losses have the same gradient with respect to the logits
+            gradient = (probabilities - targets[batch]) / len(batch)
+            gradients = []
+            for i in reversed(range(len(layers))):
+                weight = layers[i][0]
+                gradients[:0] = [
+                    inputs[i].T @ gradient + weight_decay * weight,
+                    gradient.sum(axis=0),
+                ]
+                if i:
+                    gradient = (gradient @ weight.T) * (inputs[i] > 0)
+
+            step += 1
+            for parameter, grad, moment, velocity in zip(
+                parameters, gradients, moments, velocities
+            ):
+                moment *= beta1
+                moment += (1 - beta1) * grad
+                velocity *= beta2
+                velocity += (1 - beta2) * grad**2
+                corrected = moment / (1 - beta1**step)
+                parameter -= (
+                    learning_rate
+                    * corrected
+                    / (np.sqrt(velocity / (1 - beta2**step)) + 1e-8)
+                )
+
+        if n_validation:
+            validation_rows = np.sort(validation_rows)
+            score = agreement(
+                head,
+                head.probabilities(embeddings[validation_rows]),
+                targets[validation_rows],
+            )
+            print(f"Epoch {epoch + 1}: agreement with the teacher {score:.3f}")
+
+    return head
+
+
+def sentiment_targets(directory, n_rows):
+    """
+    Returns the probabilities of sentiment_inference.py parts by row number.
+    """
+    meta = json.loads((Path(directory) / "meta.json").read_text())
+    parts = PartStore(directory, meta["chunk_size"]).read()
+    columns = [f"prob_{label.lower()}" for label in sentiment_inference.labels]
+    targets = np.full((n_rows, len(columns)), np.nan, dtype="float32")
+    targets[parts["row_id"].to_numpy()] = parts[columns].to_numpy()
+    return targets
+
+
+def predict(head, embeddings, path, chunk_size=50000):
+    """
+    Writes the probabilities of the head to a float16 .npy matrix readable by
+    topic_inference.load_topics, NaN for rows without embedding.
+    """
+    probabilities = np.lib.format.open_memmap(
+        path, mode="w+", dtype="float16", shape=(len(embeddings), len(head.labels))
+    )
+    for start in range(0, len(embeddings), chunk_size):
+        chunk = np.asarray(embeddings[start : start + chunk_size], dtype="float32")
+        probabilities[start : start + len(chunk)] = head.probabilities(chunk)
+    probabilities.flush()
+    write_progress(path, {"labels": head.labels}, len(embeddings))
+    return probabilities
+
+
+def load_embeddings(path):
+    rows_done = json.loads(progress_path(path).read_text())["rows_done"]
+    embeddings = np.load(path, mmap_mode="r")
+    if rows_done < len(embeddings):
+        raise ValueError(f"{path} has {rows_done} of {len(embeddings)} rows embedded")
+    return embeddings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    embed_parser = commands.add_parser("embed", help="embed the titles")
+    embed_parser.add_argument("input", help="CSV with the titles")
+    embed_parser.add_argument("output", help=".npy embedding matrix")
+    embed_parser.add_argument("--column", default="translated_title")
+    embed_parser.add_argument("--model", default=EMBEDDING_MODEL)
+    embed_parser.add_argument("--chunk-size", type=int, default=10000)
+    embed_parser.add_argument("--batch-size", type=int, default=128)
+    embed_parser.add_argument("--threads", type=int, help="CPU threads of the model")
+
+    for task in ["topics", "sentiment"]:
+        train_parser = commands.add_parser(f"train-{task}", help=f"{task} head")
+        train_parser.add_argument("embeddings")
+        train_parser.add_argument(
+            "teacher",
+            help="topic_inference.py matrix"
+            if task == "topics"
+            else "sentiment_inference.py directory",
+        )
+        train_parser.add_argument("output", help=".npz of the head")
+        train_parser.add_argument("--hidden", type=int, default=0, help="MLP width")
+        train_parser.add_argument("--epochs", type=int, default=20)
+        train_parser.add_argument("--learning-rate", type=float, default=1e-3)
+
+    predict_parser = commands.add_parser("predict", help="run a head")
+    predict_parser.add_argument("embeddings")
+    predict_parser.add_argument("head", help=".npz of the head")
+    predict_parser.add_argument("output", help=".npy probability matrix")
+    args = parser.parse_args()
+
+    if args.command == "embed":
+        texts = pd.read_csv(args.input, usecols=[args.column])[args.column]
+        encoder = SentenceEncoder(
+            args.model, num_threads=args.threads, batch_size=args.batch_size
+        )
+        embed_titles(encoder, texts, args.output, args.chunk_size)
+
+    elif args.command == "predict":
+        predict(Head.load(args.head), load_embeddings(args.embeddings), args.output)
+
+    else:
+        embeddings = load_embeddings(args.embeddings)
+        if args.command == "train-topics":
+            targets, labels = load_topics(args.teacher)
+            activation = "sigmoid"
+        else:
+            targets = sentiment_targets(args.teacher, len(embeddings))
+            labels, activation = sentiment_inference.labels, "softmax"
+        head = train_head(
+            embeddings,
+            targets,
+            labels,
+            activation,
+            hidden=args.hidden,
+            epochs=args.epochs,
+            learning_rate=args.learning_rate,
+        )
+        head.save(args.output)
+
+
+if __name__ == "__main__":
+    main()
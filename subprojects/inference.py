@@ -0,0 +1,271 @@
+"""
+Shared pieces of the batch inference runners.
+
+The dataset is streamed in chunks of rows. Each chunk is tokenized once,
+sorted by token length and padded per batch, so the batches carry little
+padding. The results of every chunk are written to their own parquet part,
+or to the rows of a float16 .npy matrix, an interrupted run skips the parts or
+rows that already exist.
+"""
+
+import json
+import os
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+
+class BatchedClassifier(ABC):
+    """
+    Scoring interface of the classifiers: config holds the labels of the
+    model and logits(texts) returns a (texts, labels) float32 array. The
+    backends only implement forward on a padded batch.
+    """
+
+    return_tensors = "np"
+
+    def __init__(self, tokenizer, config, batch_size=64, max_length=128):
+        self.tokenizer = tokenizer
+        self.config = config
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def batches(self, texts):
+        """
+        Yields the positions of the texts in each batch and the padded batch,
+        the texts are taken by increasing token length.
+        """
+        encoded = self.tokenizer(
+            list(texts), truncation=True, max_length=self.max_length
+        )
+        lengths = np.array([len(ids) for ids in encoded["input_ids"]])
+        order = np.argsort(lengths, kind="stable")
+        for start in range(0, len(order), self.batch_size):
+            positions = order[start : start + self.batch_size]
+            features = {
+                name: [values[i] for i in positions] for name, values in encoded.items()
+            }
+            yield positions, self.tokenizer.pad(
+                features, return_tensors=self.return_tensors
+            )
+
+    def logits(self, texts):
+        return self.run(texts, self.config.num_labels)
+
+    def run(self, texts, width):
+        outputs = np.empty((len(texts), width), dtype="float32")
+        for positions, features in self.batches(texts):
+            outputs[positions] = self.forward(features)
+        return outputs
+
+    @abstractmethod
+    def forward(self, features):
+        """
+        Returns the float32 outputs of a padded batch.
+        """
+
+
+class SequenceClassifier(BatchedClassifier):
+    """
+    Fine-tuned transformers model, on CPU with num_threads intra-op threads
+    when no GPU is available.
+    """
+
+    return_tensors = "pt"
+
+    def __init__(
+        self, model_name, device=None, num_threads=None, batch_size=64, max_length=128
+    ):
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        self.torch = torch
+        self.model_name = model_name
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        if self.device == "cpu" and num_threads:
+            torch.set_num_threads(num_threads)
+
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_name)
+        self.model.to(self.device).eval()
+        super().__init__(
+            AutoTokenizer.from_pretrained(model_name),
+            self.model.config,
+            batch_size,
+            max_length,
+        )
+
+    def forward(self, features):
+        with self.torch.inference_mode():
+            outputs = self.model(**features.to(self.device))
+        return outputs.logits.float().cpu().numpy()
+
+
+class OnnxSequenceClassifier(BatchedClassifier):
+    """
+    Model exported by onnx_export.py, run with onnxruntime. quantized loads
+    the dynamically quantized int8 graph instead of the float32 one.
+    """
+
+    def __init__(
+        self,
+        directory,
+        quantized=False,
+        num_threads=None,
+        batch_size=64,
+        max_length=128,
+    ):
+        import onnxruntime
+        from transformers import AutoConfig, AutoTokenizer
+
+        self.model_name = str(directory)
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        graph = Path(directory) / ("model.int8.onnx" if quantized else "model.onnx")
+        self.session = onnxruntime.InferenceSession(
+            str(graph), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [input.name for input in self.session.get_inputs()]
+        super().__init__(
+            AutoTokenizer.from_pretrained(directory),
+            AutoConfig.from_pretrained(directory),
+            batch_size,
+            max_length,
+        )
+
+    def forward(self, features):
+        inputs = {name: features[name].astype("int64") for name in self.input_names}
+        return self.session.run(["logits"], inputs)[0].astype("float32")
+
+
+backends = ["torch", "onnx", "onnx-int8"]
+
+
+def load_classifier(model, backend="torch", **kwargs):
+    """
+    Returns the classifier of a transformers model name or directory for the
+    torch backend, or of an onnx_export.py directory for the onnx ones.
+    """
+    if backend == "torch":
+        return SequenceClassifier(model, **kwargs)
+    return OnnxSequenceClassifier(model, quantized=backend == "onnx-int8", **kwargs)
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def sigmoid(logits):
+    return 1 / (1 + np.exp(-logits))
+
+
+class PartStore:
+    """
+    Directory of parquet parts, one per chunk of chunk_size rows.
+    """
+
+    def __init__(self, directory, chunk_size):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.chunk_size = chunk_size
+
+        # The parts of a resumed run have to cover the same rows
+        meta_path = self.directory / "meta.json"
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            if meta["chunk_size"] != chunk_size:
+                raise ValueError(
+                    f"{directory} was written with a chunk size of {meta['chunk_size']}"
+                )
+        else:
+            meta_path.write_text(json.dumps({"chunk_size": chunk_size}))
+
+    def path(self, part):
+        return self.directory / f"part-{part:05d}.parquet"
+
+    def has(self, part):
+        return self.path(part).exists()
+
+    def write(self, part, df):
+        # Written aside and renamed, a part is either complete or missing
+        partial = self.path(part).with_suffix(f".{os.getpid()}.tmp")
+        df.to_parquet(partial, index=False)
+        partial.replace(self.path(part))
+
+    def read(self):
+        parts = sorted(self.directory.glob("part-*.parquet"))
+        return pd.concat([pd.read_parquet(path) for path in parts], ignore_index=True)
+
+
+def run_chunks(input_path, text_column, store, score, desc="Scoring"):
+    """
+    Streams text_column of the CSV in chunks and stores score(texts) for the
+    chunks missing from the store. score returns a DataFrame with a row per
+    text, a row_id column with the row number in the CSV is added to it.
+    """
+    chunks = pd.read_csv(input_path, usecols=[text_column], chunksize=store.chunk_size)
+    for part, chunk in enumerate(tqdm(chunks, desc=desc, unit="chunk")):
+        if store.has(part):
+            continue
+        result = score(chunk[text_column])
+        result.insert(0, "row_id", chunk.index.to_numpy())
+        store.write(part, result)
+
+
+def progress_path(path):
+    return Path(path).with_suffix(".json")
+
+
+def read_progress(path):
+    """
+    Returns the metadata of the .npy matrix at path, with the number of scored
+    rows as rows_done.
+    """
+    return json.loads(progress_path(path).read_text())
+
+
+def write_progress(path, meta, rows_done):
+    partial = progress_path(path).with_suffix(f".{os.getpid()}.tmp")
+    partial.write_text(json.dumps({**meta, "rows_done": rows_done}))
+    partial.replace(progress_path(path))
+
+
+def score_matrix(texts, path, width, score, meta, chunk_size=5000, desc="Scoring"):
+    """
+    Writes score(texts), a (texts, width) array, to the float16 .npy matrix at
+    path, NaN rows for missing texts. Rows are scored in order and the progress
+    is saved with meta after every chunk, an existing matrix with the same meta
+    is completed instead of started over.
+    """
+    texts = pd.Series(texts).reset_index(drop=True)
+
+    if progress_path(path).exists():
+        progress = read_progress(path)
+        rows_done = progress.pop("rows_done")
+        if progress != meta:
+            raise ValueError(f"{path} was scored with another model")
+        matrix = np.load(path, mmap_mode="r+")
+    else:
+        rows_done = 0
+        matrix = np.lib.format.open_memmap(
+            path, mode="w+", dtype="float16", shape=(len(texts), width)
+        )
+        write_progress(path, meta, rows_done)
+
+    starts = range(rows_done, len(texts), chunk_size)
+    for start in tqdm(starts, desc=desc, unit="chunk"):
+        chunk = texts[start : start + chunk_size]
+        present = (chunk.notna() & (chunk.astype(str).str.strip() != "")).to_numpy()
+
+        scores = np.full((len(chunk), width), np.nan, dtype="float32")
+        if present.any():
+            scores[present] = score(chunk[present].astype(str).tolist())
+        matrix[start : start + len(chunk)] = scores
+        matrix.flush()
+        write_progress(path, meta, start + len(chunk))
+
+    return matrix
@@ -0,0 +1,272 @@
+"""
+Concurrent annotation of the titles with tags and sentiment by an LLM.
+
+Requests are sent concurrently within a requests-per-minute and
+tokens-per-minute budget, rate limit and server errors are retried with
+exponential backoff. Every answer is appended to a JSONL store keyed by row, a
+rerun only annotates the rows missing from it:
+
+    python llm_annotation.py ../tedx-dataset/tags_export.csv annotations.jsonl \\
+        --output tags_export_gpt_checkpoint.csv --rpm 500 --tpm 200000
+
+The client reads OPENAI_API_KEY, --base-url points it at any compatible
+server, such as mock_openai_server.py for testing.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+
+import pandas as pd
+from pydantic import BaseModel
+from tqdm import tqdm
+
+MODEL_NAME = "gpt-4o-mini"
+
+system_prompt = """Below you can find the title of a speech from a TEDx event.
+
+    1) Tag
+    * Choose a tag from a list of possible tags that best describes the topic of the speech. Try to pick quite a general tag that could be applied to a wide range of speeches.
+
+    2) Sentiment
+    * Assess the possible sentiment of this speech based on the title. Choose one label from the options provided. Take into account the provided sentiment explanations to guide your decision.
+
+    Examples:
+    * "How to prevent political corruption" {'tag': 'politics', 'sentiment': 'Positive'}
+    * "The art of persuasive storytelling" {'tag': 'communication', 'sentiment': 'Neutral'}
+    * "What's the point of digital fashion?" {'tag': 'sustainability', 'sentiment': 'Negative'}
+    """
+
+
+class OutputFormat(BaseModel):
+    best_tag: str
+    sentiment: str
+
+
+def user_prompt(title, tags):
+    return f"""Title: {title}.
+    Tags: {tags}.
+    Sentiment labels: 'Positive, Negative, Neutral'
+    Sentiment explanations:
+    1. Positive: Includes titles that convey optimism, inspiration, motivation, or hope. This category combines elements of positivity and inspiration, offering insight into titles that aim to motivate or uplift.
+    2. Negative: Encompasses titles that communicate pessimism, criticism, anxiety, or difficult emotions. This category can serve as an indicator of titles that address challenging topics or evoke negative emotions.
+    3. Neutral: Covers titles that are informational, educational, or factual in nature, with a neutral emotional tone. This category is useful for identifying titles that focus primarily on conveying knowledge without a strong emotional charge.
+    """
+
+
+def estimate_tokens(messages, max_output_tokens=50):
+    # About four characters per token in English, enough to pace the requests
+    return sum(len(message["content"]) for message in messages) // 4 + max_output_tokens
+
+
+class TokenBucket:
+    """
+    Refills at rate units per minute up to rate units. A request larger than
+    the bucket waits for a full bucket, usage above an estimate is debited
+    afterwards and delays the next requests.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.level = rate
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.rate, self.level + (now - self.updated) * self.rate / 60)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.rate)
+        async with self.lock:
+            self.refill()
+            while self.level < amount:
+                await asyncio.sleep((amount - self.level) * 60 / self.rate)
+                self.refill()
+            self.level -= amount
+
+    def debit(self, amount):
+        self.refill()
+        self.level -= amount
+
+
+class AnnotationStore:
+    """
+    Append-only JSONL file of the annotations, one record per row.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def read(self):
+        """
+        Returns the records indexed by row. A line cut by an interrupted
+        write is skipped, its row is annotated again.
+        """
+        records = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    records[record["row"]] = record
+        return records
+
+    def __enter__(self):
+        self.file = open(self.path, "a+", encoding="utf-8")
+        if self.file.tell():
+            self.file.seek(self.file.tell() - 1)
+            if self.file.read(1) != "\n":
+                self.file.write("\n")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+    def append(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+
+class Annotator:
+    def __init__(
+        self,
+        client,
+        model=MODEL_NAME,
+        requests_per_minute=500,
+        tokens_per_minute=200000,
+        max_retries=6,
+        max_backoff=60,
+    ):
+        self.client = client
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+
+    async def request(self, title, tags):
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt(title, tags)},
+        ]
+        estimate = estimate_tokens(messages)
+        await self.requests.acquire()
+        await self.tokens.acquire(estimate)
+        completion = await self.client.beta.chat.completions.parse(
+            model=self.model, messages=messages, response_format=OutputFormat
+        )
+        if completion.usage is not None:
+            self.tokens.debit(completion.usage.total_tokens - estimate)
+        return completion.choices[0].message.parsed
+
+    async def annotate(self, title, tags):
+        """
+        Returns the parsed answer, retrying rate limits, timeouts and server
+        errors with exponential backoff and jitter.
+        """
+        import openai
+
+        retryable = (
+            openai.RateLimitError,
+            openai.APIConnectionError,
+            openai.InternalServerError,
+        )
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.request(title, tags)
+            except retryable as error:
+                if attempt == self.max_retries:
+                    raise
+                backoff = min(self.max_backoff, 2**attempt)
+                response = getattr(error, "response", None)
+                retry_after = response is not None and response.headers.get(
+                    "retry-after"
+                )
+                if retry_after:
+                    backoff = max(backoff, float(retry_after))
+                await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+
+
+async def annotate_rows(annotator, df, store, concurrency=16):
+    """
+    Annotates the rows of df missing from the store with concurrency requests
+    in flight, appending every answer as soon as it arrives. Rows that still
+    fail after the retries are reported and left for the next run.
+    """
+    done = store.read()
+    todo = [row for row in df.index if int(row) not in done]
+    queue = asyncio.Queue()
+    for row in todo:
+        queue.put_nowait(row)
+    failed = []
+    progress = tqdm(total=len(todo), desc="Annotating titles", unit="title")
+
+    async def worker():
+        while not queue.empty():
+            row = queue.get_nowait()
+            try:
+                result = await annotator.annotate(df.at[row, "title"], df.at[row, "tag"])
+            except Exception as error:
+                failed.append(row)
+                tqdm.write(f"Row {row} failed: {error!r}")
+            else:
+                store.append({"row": int(row), **result.model_dump()})
+            progress.update()
+
+    with store, progress:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return failed
+
+
+def export(df, store):
+    """
+    Returns df with the best_tag and sentiment columns of the annotations,
+    None for the rows not annotated yet.
+    """
+    records = pd.DataFrame.from_dict(store.read(), orient="index")
+    df = df.copy()
+    for column in ["best_tag", "sentiment"]:
+        df[column] = records[column].reindex(df.index) if len(records) else None
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("input", help="CSV with the title and tag columns")
+    parser.add_argument("store", help="JSONL of the annotations")
+    parser.add_argument("--output", default="tags_export_gpt_checkpoint.csv")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--base-url", help="API URL, e.g. of the mock server")
+    parser.add_argument("--api-key", help="OPENAI_API_KEY by default")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rpm", type=int, default=500, help="requests per minute")
+    parser.add_argument("--tpm", type=int, default=200000, help="tokens per minute")
+    parser.add_argument("--max-retries", type=int, default=6)
+    args = parser.parse_args()
+
+    import openai
+
+    df = pd.read_csv(args.input)
+    # The runner does its own retries, within the budget
+    client = openai.AsyncOpenAI(
+        api_key=args.api_key, base_url=args.base_url, max_retries=0
+    )
+    annotator = Annotator(client, args.model, args.rpm, args.tpm, args.max_retries)
+    store = AnnotationStore(args.store)
+    failed = asyncio.run(annotate_rows(annotator, df, store, args.concurrency))
+
+    export(df, store).to_csv(args.output, index=True)
+    if failed:
+        print(f"{len(failed)} rows failed, rerun the command to retry them")
+
+
+if __name__ == "__main__":
+    main()
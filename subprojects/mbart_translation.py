@@ -0,0 +1,252 @@
+"""
+Batched translation of the titles to English with MBart.
+
+Titles are grouped by source language and sorted by token length, so every
+batch is translated with a single generate call and little padding. Finished
+batches are appended to a checkpoint keyed by row id, an interrupted run
+resumes where it stopped:
+
+    python mbart_translation.py tedx_videos_extended_with_lang.csv translations.csv \\
+        --batch-size 32 --threads 8
+
+Translations are also stored in a cache keyed by the normalized title, its
+language and the model, so repeated titles are translated once and reruns with
+the same model skip the model entirely.
+
+Any object with a translate(texts, src_lang) method can replace the model,
+e.g. a mock or a tiny model such as hf-internal-testing/tiny-random-mbart.
+"""
+
+import argparse
+import json
+import os
+
+import pandas as pd
+from tqdm import tqdm
+
+from translation_cache import TranslationCache, normalize_text
+
+MODEL_NAME = "facebook/mbart-large-50-many-to-many-mmt"
+
+language_dict = {
+    "ar": "ar_AR",
+    "cs": "cs_CZ",
+    "de": "de_DE",
+    "en": "en_XX",
+    "es": "es_XX",
+    "et": "et_EE",
+    "fi": "fi_FI",
+    "fr": "fr_XX",
+    "gu": "gu_IN",
+    "hi": "hi_IN",
+    "it": "it_IT",
+    "ja": "ja_XX",
+    "kk": "kk_KZ",
+    "ko": "ko_KR",
+    "lt": "lt_LT",
+    "lv": "lv_LV",
+    "my": "my_MM",
+    "ne": "ne_NP",
+    "nl": "nl_XX",
+    "ro": "ro_RO",
+    "ru": "ru_RU",
+    "si": "si_LK",
+    "tr": "tr_TR",
+    "vi": "vi_VN",
+    "zh": "zh_CN",
+    "af": "af_ZA",
+    "az": "az_AZ",
+    "bn": "bn_IN",
+    "fa": "fa_IR",
+    "he": "he_IL",
+    "hr": "hr_HR",
+    "id": "id_ID",
+    "ka": "ka_GE",
+    "km": "km_KH",
+    "mk": "mk_MK",
+    "ml": "ml_IN",
+    "mn": "mn_MN",
+    "mr": "mr_IN",
+    "pl": "pl_PL",
+    "ps": "ps_AF",
+    "pt": "pt_XX",
+    "sv": "sv_SE",
+    "sw": "sw_KE",
+    "ta": "ta_IN",
+    "te": "te_IN",
+    "th": "th_TH",
+    "tl": "tl_XX",
+    "uk": "uk_UA",
+    "ur": "ur_PK",
+    "xh": "xh_ZA",
+    "gl": "gl_ES",
+    "sl": "sl_SI",
+}
+
+
+class MBartBackend:
+    def __init__(self, model_name=MODEL_NAME, device=None, num_threads=None):
+        import torch
+        from transformers import MBart50TokenizerFast, MBartForConditionalGeneration
+
+        self.torch = torch
+        self.model_name = model_name
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        if self.device == "cpu" and num_threads:
+            # Intra-op threads of the matrix multiplications, one model in memory
+            torch.set_num_threads(num_threads)
+
+        self.model = MBartForConditionalGeneration.from_pretrained(model_name)
+        self.model.to(self.device).eval()
+        self.tokenizer = MBart50TokenizerFast.from_pretrained(model_name)
+
+    def token_lengths(self, texts, src_lang):
+        self.tokenizer.src_lang = src_lang
+        return [len(ids) for ids in self.tokenizer(texts)["input_ids"]]
+
+    def translate(self, texts, src_lang):
+        self.tokenizer.src_lang = src_lang
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, return_tensors="pt"
+        ).to(self.device)
+        with self.torch.inference_mode():
+            generated_tokens = self.model.generate(
+                **encoded, forced_bos_token_id=self.tokenizer.lang_code_to_id["en_XX"]
+            )
+        return self.tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
+
+
+def read_checkpoint(path):
+    """
+    Returns the translations of the checkpoint indexed by row id. A line cut
+    by an interrupted write is skipped, its row is translated again.
+    """
+    translations = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                translations[record["row_id"]] = record["translated_title"]
+    return pd.Series(translations, dtype=object)
+
+
+def ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def make_batches(texts, lengths, batch_size):
+    """
+    Yields batches of the index of texts, sorted by length so that the
+    texts of a batch are padded to about the same length.
+    """
+    order = pd.Series(lengths, index=texts.index).sort_values(kind="stable").index
+    for start in range(0, len(order), batch_size):
+        yield order[start : start + batch_size]
+
+
+def translate_titles(
+    df,
+    backend,
+    batch_size=32,
+    checkpoint_path="translation_checkpoint.jsonl",
+    text_column="title",
+    language_column="language",
+    cache=None,
+):
+    """
+    Translates the titles of the languages supported by MBart, returning the
+    translations indexed like df, None for the other rows. df index values
+    are the row ids of the checkpoint, they have to be unique. Titles found
+    in the cache are not translated again.
+    """
+    model = getattr(backend, "model_name", type(backend).__name__)
+    done = read_checkpoint(checkpoint_path)
+    row_ids = df.index.astype(str)
+    texts = df[text_column]
+    todo = (
+        df[language_column].isin(language_dict.keys())
+        & texts.map(lambda text: isinstance(text, str) and text.strip() != "")
+        & ~row_ids.isin(done.index)
+    )
+
+    progress = tqdm(total=int(todo.sum()), desc="Translating titles", unit="title")
+    with open(checkpoint_path, "a+", encoding="utf-8") as f, progress:
+        if f.tell() and not ends_with_newline(checkpoint_path):
+            f.write("\n")
+        for language, group in df[todo].groupby(language_column):
+            src_lang = language_dict[language]
+            # Rows sharing a normalized title get the translation of one of them
+            keys = group[text_column].map(normalize_text)
+            rows_by_key = keys.groupby(keys, sort=False).groups
+            unique_keys = pd.Series(list(rows_by_key), dtype=object)
+
+            def write(translations):
+                for key, translation in translations.items():
+                    for row_id in rows_by_key[key].astype(str):
+                        record = {"row_id": row_id, "translated_title": translation}
+                        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                        progress.update()
+                f.flush()
+
+            if cache is not None:
+                cached = cache.get_many(unique_keys, language, model)
+                write(cached)
+                unique_keys = unique_keys[~unique_keys.isin(cached.keys())]
+            if unique_keys.empty:
+                continue
+
+            if hasattr(backend, "token_lengths"):
+                lengths = backend.token_lengths(unique_keys.tolist(), src_lang)
+            else:
+                lengths = unique_keys.str.len()
+
+            for batch in make_batches(unique_keys, lengths, batch_size):
+                texts = unique_keys[batch].tolist()
+                translations = dict(zip(texts, backend.translate(texts, src_lang)))
+                if cache is not None:
+                    cache.put_many(translations, language, model)
+                write(translations)
+
+    done = read_checkpoint(checkpoint_path)
+    return pd.Series(done.reindex(row_ids).to_numpy(), index=df.index).where(
+        df[language_column].isin(language_dict.keys()), None
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("input", help="CSV with title and language columns")
+    parser.add_argument("output")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--threads", type=int, help="CPU threads of the model")
+    parser.add_argument("--checkpoint", default="translation_checkpoint.jsonl")
+    parser.add_argument("--cache", default="translation_cache.sqlite")
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.input, low_memory=False)
+    df = df[df["language"] != "en"]
+    backend = MBartBackend(args.model, num_threads=args.threads)
+    cache = TranslationCache(args.cache)
+    try:
+        df["translated_text"] = translate_titles(
+            df, backend, args.batch_size, args.checkpoint, cache=cache
+        )
+    finally:
+        cache.close()
+    df.to_csv(args.output, index=False)
+
+    stats = cache.stats()
+    print(
+        f"Translation cache: {stats['hits']} hits, {stats['misses']} misses "
+        f"({stats['hit_rate']:.1%} hit rate)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Local stand-in for the OpenAI chat completions API of the annotation runner.
+
+Answers structured output requests with a tag taken from the prompt's tag list
+and a sentiment chosen from a hash of the title, after a simulated latency.
+It can also answer some requests with rate limit errors, and enforces its own
+requests-per-minute limit when given one:
+
+    python mock_openai_server.py --port 8000 --latency 0.5 --error-rate 0.05
+    python llm_annotation.py tags_export.csv annotations.jsonl \\
+        --base-url http://localhost:8000/v1 --api-key mock
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sentiments = ["Positive", "Negative", "Neutral"]
+
+
+def answer(messages):
+    prompt = messages[-1]["content"]
+    title = re.search(r"Title: (.*)\.\n", prompt)
+    tags = re.search(r"Tags: (.*)\.\n", prompt)
+    title = title.group(1) if title else prompt
+    tags = tags.group(1).split(", ") if tags else ["other"]
+
+    digest = hashlib.blake2b(title.encode("utf-8"), digest_size=8).digest()
+    return {"best_tag": tags[0], "sentiment": sentiments[digest[0] % len(sentiments)]}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    error_rate = 0.0
+    requests_per_minute = None
+    recent = deque()
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def rate_limited(self):
+        if random.random() < self.error_rate:
+            return True
+        if self.requests_per_minute is None:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            while self.recent and now - self.recent[0] > 60:
+                self.recent.popleft()
+            if len(self.recent) >= self.requests_per_minute:
+                return True
+            self.recent.append(now)
+            return False
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "Not found"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+        if self.rate_limited():
+            error = {"message": "Rate limit reached", "type": "requests"}
+            self.send_json(429, {"error": error}, [("Retry-After", "1")])
+            return
+
+        time.sleep(self.latency)
+        content = json.dumps(answer(request["messages"]))
+        prompt_tokens = sum(len(m["content"]) for m in request["messages"]) // 4
+        completion_tokens = len(content) // 4
+        self.send_json(
+            200,
+            {
+                "id": f"chatcmpl-mock-{time.time_ns()}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": content,
+                            "refusal": None,
+                        },
+                        "logprobs": None,
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+
+def make_server(port=8000, latency=0.0, error_rate=0.0, requests_per_minute=None):
+    handler = type(
+        "Handler",
+        (MockHandler,),
+        {
+            "latency": latency,
+            "error_rate": error_rate,
+            "requests_per_minute": requests_per_minute,
+            "recent": deque(),
+        },
+    )
+    return ThreadingHTTPServer(("127.0.0.1", port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, help="requests per minute limit")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.latency, args.error_rate, args.rpm)
+    print(f"Serving on http://127.0.0.1:{server.server_port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+ONNX export and int8 quantization of the fine-tuned classifiers for CPU inference.
+
+Each model is exported to a directory with model.onnx, its dynamically
+quantized model.int8.onnx and the tokenizer and config of the model:
+
+    python onnx_export.py export sentiment onnx/sentiment
+    python onnx_export.py export topics onnx/topics
+
+The parity check scores the test set of the model with every backend and
+reports the accuracy, the agreement with the torch predictions and the
+throughput, before the exported models replace it:
+
+    python onnx_export.py parity sentiment onnx/sentiment --threads 8
+
+The inference runners load an exported directory with --backend onnx or
+--backend onnx-int8 and --model set to the directory. Requires onnx and
+onnxruntime besides torch and transformers.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import sentiment_inference
+import topic_inference
+from inference import backends, load_classifier, sigmoid, softmax
+
+models = {
+    "sentiment": sentiment_inference.MODEL_NAME,
+    "topics": topic_inference.MODEL_NAME,
+}
+test_sets = {
+    "sentiment": Path(__file__).parent / "finetune-sets" / "sentiment_test.csv",
+    "topics": Path(__file__).parent / "finetune-sets" / "topics_test.csv",
+}
+
+
+def export_onnx(model_name, output_dir, opset=14):
+    """
+    Exports the logits of the model with dynamic batch and sequence axes.
+    """
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    class Logits(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+
+    example = tokenizer(
+        ["The world in 2200", "Why we sleep"], padding=True, return_tensors="pt"
+    )
+    axes = {0: "batch", 1: "sequence"}
+    with torch.inference_mode():
+        torch.onnx.export(
+            Logits(model),
+            (example["input_ids"], example["attention_mask"]),
+            str(output_dir / "model.onnx"),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes={
+                "input_ids": axes,
+                "attention_mask": axes,
+                "logits": {0: "batch"},
+            },
+            opset_version=opset,
+        )
+    tokenizer.save_pretrained(output_dir)
+    model.config.save_pretrained(output_dir)
+
+
+def quantize(output_dir):
+    """
+    Writes model.int8.onnx, the weights of the matrix multiplications stored
+    as int8 and the activations quantized at runtime.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    output_dir = Path(output_dir)
+    quantize_dynamic(
+        str(output_dir / "model.onnx"),
+        str(output_dir / "model.int8.onnx"),
+        weight_type=QuantType.QInt8,
+    )
+
+
+def predict(classifier, task, texts):
+    """
+    Returns the predicted label of each text and the titles scored per second.
+    """
+    start = time.perf_counter()
+    logits = classifier.logits(texts)
+    elapsed = time.perf_counter() - start
+
+    if task == "sentiment":
+        labels = np.array(sentiment_inference.labels, dtype=object)
+        predicted = labels[softmax(logits).argmax(axis=1)]
+    else:
+        config = classifier.config
+        labels = [config.id2label[i] for i in range(config.num_labels)]
+        predicted = topic_inference.assign_categories(sigmoid(logits), labels)
+        predicted = predicted["category"].to_numpy()
+    return predicted, len(texts) / elapsed
+
+
+def parity(task, onnx_dir, model_name=None, **kwargs):
+    """
+    Scores the test set of the task with every backend, returns a DataFrame
+    with the accuracy, the agreement with torch and the throughput of each.
+    """
+    test = pd.read_csv(test_sets[task])
+    texts = test["title"].astype(str).tolist()
+    actual = test["sentiment" if task == "sentiment" else "best_tag"].to_numpy()
+
+    results, reference = [], None
+    for backend in backends:
+        if backend == "torch":
+            classifier = load_classifier(
+                model_name or models[task], backend, device="cpu", **kwargs
+            )
+        else:
+            classifier = load_classifier(onnx_dir, backend, **kwargs)
+        predicted, throughput = predict(classifier, task, texts)
+        if reference is None:
+            reference = predicted
+        results.append(
+            {
+                "backend": backend,
+                "accuracy": (predicted == actual).mean(),
+                "agreement": (predicted == reference).mean(),
+                "titles_per_second": throughput,
+            }
+        )
+
+    results = pd.DataFrame(results).set_index("backend")
+    results["accuracy_change"] = results["accuracy"] - results.loc["torch", "accuracy"]
+    results["speedup"] = (
+        results["titles_per_second"] / results.loc["torch", "titles_per_second"]
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="export and quantize a model")
+    export_parser.add_argument("task", choices=models)
+    export_parser.add_argument("output", help="directory of the exported model")
+    export_parser.add_argument("--model", help="model name, the task model by default")
+    export_parser.add_argument("--opset", type=int, default=14)
+
+    parity_parser = commands.add_parser("parity", help="compare the backends")
+    parity_parser.add_argument("task", choices=models)
+    parity_parser.add_argument("onnx_dir", help="directory of the exported model")
+    parity_parser.add_argument("--model", help="model name, the task model by default")
+    parity_parser.add_argument("--batch-size", type=int, default=32)
+    parity_parser.add_argument("--threads", type=int, help="CPU threads of the model")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(args.model or models[args.task], args.output, args.opset)
+        quantize(args.output)
+    else:
+        results = parity(
+            args.task,
+            args.onnx_dir,
+            args.model,
+            num_threads=args.threads,
+            batch_size=args.batch_size,
+        )
+        print(results.round(3).to_string())
+
+
+if __name__ == "__main__":
+    main()
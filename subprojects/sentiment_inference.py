@@ -0,0 +1,70 @@
+"""
+Sentiment of the translated titles with the fine-tuned BERTweet model.
+
+    python sentiment_inference.py FINAL_TEDX_DATASET_2024.csv sentiment/ --threads 8
+
+Writes a parquet part per chunk of rows with the row_id, the sentiment and the
+probability of each class. Rerunning the command resumes an interrupted run.
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from inference import PartStore, backends, load_classifier, run_chunks, softmax
+
+MODEL_NAME = "CzarnyBaranie/finetuning-sentiment-model-tedx"
+labels = ["Neutral", "Negative", "Positive"]
+
+
+def score_sentiment(classifier, texts):
+    """
+    Returns the sentiment and class probabilities of the texts,
+    None and NaN for missing texts.
+    """
+    texts = pd.Series(texts).reset_index(drop=True)
+    present = texts.notna() & (texts.astype(str).str.strip() != "")
+
+    probabilities = np.full((len(texts), len(labels)), np.nan, dtype="float32")
+    if present.any():
+        probabilities[present.to_numpy()] = softmax(
+            classifier.logits(texts[present].astype(str).tolist())
+        )
+
+    result = pd.DataFrame(
+        probabilities, columns=[f"prob_{label.lower()}" for label in labels]
+    )
+    predicted = np.nan_to_num(probabilities).argmax(axis=1)
+    sentiment = np.array(labels, dtype=object)[predicted]
+    result.insert(0, "sentiment", np.where(present, sentiment, None))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("input", help="CSV of the dataset")
+    parser.add_argument("output", help="directory of the parquet parts")
+    parser.add_argument("--column", default="translated_title")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--backend", choices=backends, default="torch")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, help="CPU threads of the model")
+    args = parser.parse_args()
+
+    classifier = load_classifier(
+        args.model, args.backend, num_threads=args.threads, batch_size=args.batch_size
+    )
+    store = PartStore(args.output, args.chunk_size)
+    run_chunks(
+        args.input,
+        args.column,
+        store,
+        lambda texts: score_sentiment(classifier, texts),
+        desc="Scoring sentiment",
+    )
+
+
+if __name__ == "__main__":
+    main()
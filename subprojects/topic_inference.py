@@ -0,0 +1,194 @@
+"""
+Multi-label topic inference with the fine-tuned BART classifier.
+
+The sigmoid probabilities of all the labels are stored per talk as a float16
+.npy matrix, so the categories can be assigned again with other thresholds
+without running the model:
+
+    python topic_inference.py score finetune-sets/topics_test.csv test.npy --column title
+    python topic_inference.py tune test.npy finetune-sets/topics_test.csv thresholds.json
+    python topic_inference.py score FINAL_TEDX_DATASET_2024.csv topics.npy --threads 8
+    python topic_inference.py assign topics.npy categories.csv --thresholds thresholds.json
+
+Scoring writes the rows in chunks and records its progress next to the matrix,
+rerunning the command resumes an interrupted run.
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from inference import backends, load_classifier, read_progress, score_matrix, sigmoid
+
+MODEL_NAME = "CzarnyBaranie/bart-finetuned-for-tedx-topics"
+
+
+def score_topics(classifier, texts, path, chunk_size=5000):
+    """
+    Writes the probabilities of the texts to the .npy file at path, NaN for
+    missing texts. Rows are scored in order and the progress is saved after
+    every chunk, an existing matrix is completed instead of started over.
+    """
+    config = classifier.config
+    labels = [config.id2label[i] for i in range(config.num_labels)]
+    return score_matrix(
+        texts,
+        path,
+        len(labels),
+        lambda texts: sigmoid(classifier.logits(texts)),
+        {"labels": labels},
+        chunk_size,
+        desc="Scoring topics",
+    )
+
+
+def load_topics(path):
+    """
+    Returns the memory-mapped probability matrix and the labels of its columns.
+    Fails when the scoring of the matrix was interrupted, as its remaining rows
+    are still zero.
+    """
+    progress = read_progress(path)
+    labels, rows_done = progress["labels"], progress["rows_done"]
+    probabilities = np.load(path, mmap_mode="r")
+    if rows_done < len(probabilities):
+        raise ValueError(
+            f"{path} has {rows_done} of {len(probabilities)} rows scored, "
+            "run the scoring again to complete it"
+        )
+    return probabilities, labels
+
+
+def label_matrix(categories, labels):
+    """
+    One-hot matrix of comma separated categories, e.g. the best_tag column.
+    """
+    index = {label: i for i, label in enumerate(labels)}
+    matrix = np.zeros((len(categories), len(labels)), dtype=bool)
+    for row, tags in enumerate(categories):
+        for tag in str(tags).split(", "):
+            if tag in index:
+                matrix[row, index[tag]] = True
+    return matrix
+
+
+def f1_scores(predicted, actual):
+    """
+    F1 score of each column, predicted is (rows, labels, thresholds) and
+    actual (rows, labels).
+    """
+    actual = actual[:, :, None]
+    tp = (predicted & actual).sum(axis=0)
+    fp = (predicted & ~actual).sum(axis=0)
+    fn = (~predicted & actual).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.nan_to_num(2 * tp / (2 * tp + fp + fn))
+
+
+def tune_thresholds(probabilities, actual, grid=np.arange(0.05, 0.96, 0.05)):
+    """
+    Returns the threshold of each label maximizing its F1 score, labels
+    without any positive example keep 0.5.
+    """
+    probabilities = np.asarray(probabilities, dtype="float32")
+    predicted = probabilities[:, :, None] >= grid[None, None, :]
+    scores = f1_scores(predicted, actual)
+    thresholds = grid[scores.argmax(axis=1)]
+    return np.where(actual.any(axis=0), thresholds, 0.5)
+
+
+def micro_f1(probabilities, actual, thresholds):
+    predicted = np.asarray(probabilities, dtype="float32") >= thresholds
+    tp = (predicted & actual).sum()
+    return 2 * tp / (predicted.sum() + actual.sum())
+
+
+def assign_categories(probabilities, labels, thresholds=0.5):
+    """
+    Returns the category of each row, the first label above its threshold or
+    the most probable one when none is, and all the labels above their
+    thresholds joined by ', '. Rows without probabilities get None.
+    """
+    labels = np.array(labels, dtype=object)
+    categories, all_categories = [], []
+    chunk_size = 50000
+    for start in range(0, len(probabilities), chunk_size):
+        chunk = np.asarray(probabilities[start : start + chunk_size], dtype="float32")
+        missing = np.isnan(chunk).all(axis=1)
+        chunk = np.nan_to_num(chunk, nan=-1)
+        above = chunk >= thresholds
+
+        first = np.where(above.any(axis=1), above.argmax(axis=1), chunk.argmax(axis=1))
+        categories.extend(np.where(missing, None, labels[first]))
+        all_categories.extend(
+            None if is_missing else ", ".join(labels[row])
+            for row, is_missing in zip(above, missing)
+        )
+    return pd.DataFrame({"category": categories, "categories": all_categories})
+
+
+def read_thresholds(path, labels):
+    thresholds = json.loads(Path(path).read_text())
+    return np.array([thresholds.get(label, 0.5) for label in labels])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    score_parser = commands.add_parser("score", help="run the model")
+    score_parser.add_argument("input", help="CSV with the titles")
+    score_parser.add_argument("output", help=".npy probability matrix")
+    score_parser.add_argument("--column", default="translated_title")
+    score_parser.add_argument("--model", default=MODEL_NAME)
+    score_parser.add_argument("--backend", choices=backends, default="torch")
+    score_parser.add_argument("--chunk-size", type=int, default=5000)
+    score_parser.add_argument("--batch-size", type=int, default=32)
+    score_parser.add_argument("--threads", type=int, help="CPU threads of the model")
+
+    tune_parser = commands.add_parser("tune", help="tune per-label thresholds")
+    tune_parser.add_argument("probabilities", help="scored test set")
+    tune_parser.add_argument("test", help="CSV with the best_tag column")
+    tune_parser.add_argument("output", help="JSON of the thresholds")
+
+    assign_parser = commands.add_parser("assign", help="assign the categories")
+    assign_parser.add_argument("probabilities")
+    assign_parser.add_argument("output", help="CSV of the categories")
+    assign_parser.add_argument("--thresholds", help="JSON of the thresholds")
+    args = parser.parse_args()
+
+    if args.command == "score":
+        texts = pd.read_csv(args.input, usecols=[args.column])[args.column]
+        classifier = load_classifier(
+            args.model,
+            args.backend,
+            num_threads=args.threads,
+            batch_size=args.batch_size,
+        )
+        score_topics(classifier, texts, args.output, args.chunk_size)
+
+    elif args.command == "tune":
+        probabilities, labels = load_topics(args.probabilities)
+        actual = label_matrix(pd.read_csv(args.test)["best_tag"], labels)
+        thresholds = tune_thresholds(probabilities, actual)
+        print(f"Micro F1 at 0.5: {micro_f1(probabilities, actual, 0.5):.3f}")
+        print(f"Micro F1 tuned: {micro_f1(probabilities, actual, thresholds):.3f}")
+        Path(args.output).write_text(
+            json.dumps(dict(zip(labels, thresholds.round(2).tolist())), indent=4)
+        )
+
+    else:
+        probabilities, labels = load_topics(args.probabilities)
+        thresholds = 0.5
+        if args.thresholds:
+            thresholds = read_thresholds(args.thresholds, labels)
+        assign_categories(probabilities, labels, thresholds).to_csv(
+            args.output, index=False
+        )
+
+
+if __name__ == "__main__":
+    main()
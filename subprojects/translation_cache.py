@@ -0,0 +1,76 @@
+"""
+Persistent cache of the translations, shared by every run of the translation.
+
+Translations are keyed by the normalized source text, its language and the
+model that translated it, so repeated titles are decoded once and a rerun with
+the same model only translates the titles it has never seen.
+"""
+
+import re
+import sqlite3
+import threading
+import unicodedata
+
+
+def normalize_text(text):
+    """
+    Unicode and whitespace variants of a title share one translation.
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class TranslationCache:
+    def __init__(self, path="translation_cache.sqlite"):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS translations "
+            "(text TEXT, language TEXT, model TEXT, translation TEXT, "
+            "PRIMARY KEY (text, language, model))"
+        )
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get_many(self, texts, language, model):
+        """
+        Returns the cached translations of the normalized texts as a dict.
+        """
+        found = {}
+        texts = list(texts)
+        # Stays below the default limit of SQLite variables per query
+        for start in range(0, len(texts), 900):
+            chunk = texts[start : start + 900]
+            placeholders = ",".join("?" * len(chunk))
+            cursor = self.connection.execute(
+                "SELECT text, translation FROM translations "
+                f"WHERE language = ? AND model = ? AND text IN ({placeholders})",
+                [language, model, *chunk],
+            )
+            found.update(cursor.fetchall())
+        with self.lock:
+            self.hits += len(found)
+            self.misses += len(set(texts)) - len(found)
+        return found
+
+    def put_many(self, translations, language, model):
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)",
+            [
+                (text, language, model, translation)
+                for text, translation in translations.items()
+            ],
+        )
+        self.connection.commit()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        self.connection.close()